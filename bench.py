@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import time
+import random
+import itertools
+import argparse
+import platform
+import tempfile
+import subprocess
+
+# Бенчмарк гоняет игру без окна; запускать из папки игры (нужна папка sprites/)
+os.environ.setdefault("ECHO_HEADLESS", "1")
+import ppc  # noqa: E402
+
+PHASES = ("update", "collision", "draw")
+
+
+# --- Карты для стресс-сцен ---
+def arena(cols, rows, border="W"):
+    level_map = [border * cols]
+    for _ in range(rows - 2):
+        level_map.append(border + " " * (cols - 2) + border)
+    level_map.append(border * cols)
+    return level_map
+
+
+def scatter(level_map, tile, count, avoid=((2, 2),)):
+    # Расставляет count тайлов по пустым клеткам карты; клетку игрока не трогаем
+    grid = [list(row) for row in level_map]
+    free = [(col, row) for row, line in enumerate(grid) for col, char in enumerate(line)
+            if char == " " and (col, row) not in avoid]
+    for col, row in random.sample(free, min(count, len(free))):
+        grid[row][col] = tile
+    return ["".join(row) for row in grid]
+
+
+# --- Стресс-сцены ---
+# Сцена строит уровень и возвращает функцию, которую вызывают перед каждым
+# кадром вне замеров (подкинуть снаряды до нужного количества), или None
+def scene_shooters(count):
+    ppc.world.setup_level(scatter(arena(40, 20), "E", count))
+    return None
+
+
+def live_bullets():
+    projectiles = ppc.world.projectiles
+    if projectiles is not None:
+        return int((projectiles.kind[:projectiles.count] == ppc.PROJECTILE_BULLET).sum())
+    return len(ppc.world.bullets)
+
+
+def live_waves():
+    projectiles = ppc.world.projectiles
+    if projectiles is not None:
+        return int((projectiles.kind[:projectiles.count] == ppc.PROJECTILE_WAVE).sum())
+    return len(ppc.world.waves)
+
+
+def scene_bullets(count):
+    ppc.world.setup_level(scatter(arena(20, 10), "W", 20))
+
+    def top_up():
+        for _ in range(count - live_bullets()):
+            ppc.world.spawn_bullet(random.randint(60, ppc.WIDTH - 60), random.randint(60, ppc.HEIGHT - 60),
+                                   random.choice([-5, 5]), random.choice([-5, 5]))
+    return top_up
+
+
+def scene_waves(count):
+    # Волны разгоняются, отражаясь от усиливающих стен
+    ppc.world.max_waves = count
+    ppc.world.setup_level(scatter(arena(20, 10, border="A"), "A", 25))
+
+    def top_up():
+        for _ in range(count - live_waves()):
+            dx, dy = random.uniform(-1, 1), random.uniform(-1, 1)
+            magnitude = (dx ** 2 + dy ** 2) ** 0.5 or 1
+            ppc.world.spawn_wave(random.randint(60, ppc.WIDTH - 60), random.randint(60, ppc.HEIGHT - 60),
+                                 dx / magnitude * 10, dy / magnitude * 10)
+            ppc.world.current_waves += 1
+    return top_up
+
+
+def scene_large_map(cols):
+    level_map = arena(cols, cols // 2)
+    for tile, share in (("W", 0.08), ("A", 0.02), ("P", 0.02), ("E", 0.01), ("H", 0.005), ("X", 0.005)):
+        level_map = scatter(level_map, tile, int(cols * cols // 2 * share))
+    ppc.world.setup_level(level_map)
+    return None
+
+
+SCENES = {
+    "shooters": (scene_shooters, 300),
+    "bullets": (scene_bullets, 2000),
+    "waves": (scene_waves, 200),
+    "large_map": (scene_large_map, 200),
+}
+
+
+# --- Замеры ---
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        "max": ordered[-1],
+    }
+
+
+def measure(world, inputs, load_ms, before=None):
+    # inputs - по кадру (клавиши, точки выстрелов, шаг в мс); before вызывается перед кадром вне замеров
+    timings = {phase: [] for phase in PHASES}
+    for keys, fire_targets, dt in inputs:
+        if before is not None:
+            before()
+        t0 = time.perf_counter()
+        world.update_sprites(keys, fire_targets)
+        t1 = time.perf_counter()
+        world.resolve_collisions()
+        t2 = time.perf_counter()
+        world.render_frame()
+        t3 = time.perf_counter()
+        world.advance_time(dt)
+        timings["update"].append((t1 - t0) * 1000)
+        timings["collision"].append((t2 - t1) * 1000)
+        timings["draw"].append((t3 - t2) * 1000)
+    result = {phase: summarize(samples) for phase, samples in timings.items()}
+    result["total"] = summarize([sum(parts) for parts in zip(*timings.values())])
+    result["load_ms"] = load_ms
+    result["sprites"] = {"enemies": len(world.enemies), "bullets": live_bullets(), "waves": live_waves(),
+                         "walls": world.wall_grid.wall_count}
+    return result
+
+
+def run_scene(name, frames, seed, size=None):
+    build, default_size = SCENES[name]
+    random.seed(seed)
+    world = ppc.new_world(seed=seed)
+    start = time.perf_counter()
+    top_up = build(size or default_size)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    def before():
+        world.player.health = 10 ** 9  # игрок не должен умирать, иначе уровень перезапустится
+        if top_up is not None:
+            top_up()
+    return measure(world, itertools.repeat((ppc.ScriptedKeys(), (), ppc.SIM_STEP), frames), load_ms, before)
+
+
+def run_replay(path, frames):
+    # Записанная сессия (ppc.py --record) как нагрузка: тот же ввод, те же случайности
+    recording = ppc.Recording.load(path)
+    start = time.perf_counter()
+    world = ppc.new_world(recording.level, recording.seed)
+    load_ms = (time.perf_counter() - start) * 1000
+    return measure(world, itertools.islice(recording.inputs(), frames), load_ms)
+
+
+# --- Проверки ---
+def wave_positions(world):
+    projectiles = world.projectiles
+    if projectiles is not None:
+        return [(int(projectiles.x[i]), int(projectiles.w[i]), float(projectiles.dx[i]))
+                for i in range(projectiles.count) if projectiles.kind[i] == ppc.PROJECTILE_WAVE]
+    return [(wave.rect.x, wave.rect.w, wave.dx) for wave in world.waves]
+
+
+def check_growing_waves(frames=40):
+    # Волны летят в левую стену и растут на ходу; при каждом старте рост
+    # приходится на свой момент относительно касания. Все должны отскочить,
+    # не заходя в стену. Возвращает список стартовых x, где это не так
+    failures = []
+    for start in range(ppc.TILE_SIZE + 13, ppc.TILE_SIZE * 3):
+        world = ppc.new_world(seed=start)
+        world.setup_level(arena(20, 10))
+        world.spawn_wave(start, ppc.TILE_SIZE * 7 - 5, -9.83, 0.0)
+        inside = True
+        for _ in range(frames):
+            world.player.health = 10 ** 9
+            world.update_sprites(ppc.ScriptedKeys(), ())
+            world.advance_time(ppc.SIM_STEP)
+            inside = inside and all(x >= ppc.TILE_SIZE for x, _, _ in wave_positions(world))
+        waves = wave_positions(world)
+        if not inside or not waves or waves[0][2] <= 0:
+            failures.append(start)
+    return failures
+
+
+def check_fractional_replay(ticks=120):
+    # Дробные точки выстрела из скрипта ввода должны записаться и повториться
+    # как есть; возвращает итог повтора
+    script = [{"fire": [[300.5, 200]]}, {}, {"keys": ["left"], "fire": [[120.25, 330.75]]}]
+    with tempfile.TemporaryDirectory() as folder:
+        script_path = os.path.join(folder, "input.json")
+        record_path = os.path.join(folder, "input.rec")
+        with open(script_path, 'w') as f:
+            json.dump(script, f)
+        ppc.run_headless(0, ticks, ppc.load_input_script(script_path), seed=1, record=record_path)
+        return ppc.replay(record_path)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old, new, threshold):
+    # Сравнение средних времён по фазам; возвращает список регрессий
+    regressions = []
+    for name, scene in new["scenes"].items():
+        if name not in old["scenes"]:
+            continue
+        for phase in PHASES + ("total",):
+            before = old["scenes"][name][phase]["mean"]
+            after = scene[phase]["mean"]
+            ratio = after / before if before else 1.0
+            mark = ""
+            if ratio > 1 + threshold:
+                mark = "  <-- регрессия"
+                regressions.append((name, phase, ratio))
+            print(f"{name:10} {phase:10} {before:8.3f} -> {after:8.3f} мс  x{ratio:.2f}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк стресс-сцен Эхо-рыцаря")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--scene", action="append", choices=sorted(SCENES), help="по умолчанию все сцены")
+    parser.add_argument("--size", type=int, help="размер сцены вместо значения по умолчанию")
+    parser.add_argument("--replay", action="append", default=[], help="запись сессии как ещё одна сцена")
+    parser.add_argument("--numpy", action="store_true", help="снаряды через ProjectileSystem")
+    parser.add_argument("--renderer", choices=ppc.RENDERERS, help="бэкенд отрисовки, по умолчанию как в ppc.py")
+    parser.add_argument("--check", action="store_true", help="сначала проверить отскок растущих волн от стен и повтор дробного ввода")
+    parser.add_argument("--out", help="куда записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.10, help="допустимое замедление, доля")
+    args = parser.parse_args()
+
+    if args.numpy:
+        if not ppc.load_numpy():
+            parser.error("numpy не установлен")
+        ppc.NUMPY_PROJECTILES = True
+    ppc.init_display(args.renderer)
+    if args.check:
+        failures = check_growing_waves()
+        if failures:
+            print(f"волны зашли в стену при старте с x = {failures}")
+            sys.exit(1)
+        print("проверка волн у стен пройдена")
+        report = check_fractional_replay()
+        if report["match"] is not True:
+            print(f"повтор записи с дробными выстрелами разошёлся: {report}")
+            sys.exit(1)
+        print("проверка повтора дробного ввода пройдена")
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pygame": ppc.pygame.version.ver,
+        "numpy_projectiles": ppc.NUMPY_PROJECTILES,
+        "renderer": args.renderer or ppc.RENDERER,
+        "frames": args.frames,
+        "seed": args.seed,
+        "scenes": {},
+    }
+    def report(name, scene):
+        results["scenes"][name] = scene
+        print(f"{name:10} " + "  ".join(f"{phase} {scene[phase]['mean']:.3f}/{scene[phase]['p95']:.3f}"
+                                        for phase in PHASES + ("total",)) + " мс (среднее/p95)")
+
+    # С --replay без --scene меряются только записи
+    for name in args.scene or ([] if args.replay else sorted(SCENES)):
+        report(name, run_scene(name, args.frames, args.seed, args.size))
+    for path in args.replay:
+        report(os.path.basename(path), run_replay(path, args.frames))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            old = json.load(f)
+        if compare(old, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
+
+# Окружения гоняют игру без окна; запускать из папки игры (нужна папка sprites/)
+os.environ.setdefault("ECHO_HEADLESS", "1")
+import ppc  # noqa: E402
+
+ENV_MOVES = ((), ("left",), ("right",), ("up",), ("down",))
+LEVEL_REWARD = 100  # награда за переход на следующий уровень
+OBSERVATION = ("player_x", "player_y", "health", "score", "level", "has_key", "waves_left",
+               "enemies", "bullets", "key_x", "key_y", "door_x", "door_y")
+
+
+# --- Окружение ---
+class GameEnv:
+    # step/reset над ppc.World. Действие - пара (move, target): move - индекс
+    # в ENV_MOVES, target - точка, куда выпустить волну, или None. Награда за
+    # тик: прирост очков + LEVEL_REWARD за пройденный уровень - потерянное
+    # здоровье. Эпизод кончается победой или через max_ticks тиков
+    def __init__(self, level=0, seed=None, max_ticks=ppc.FPS * 60, dt=ppc.SIM_STEP):
+        self.level = level
+        self.seed = seed
+        self.max_ticks = max_ticks
+        self.dt = dt
+        self.keys = [ppc.ScriptedKeys(ppc.SCRIPT_KEYS[name] for name in move) for move in ENV_MOVES]
+        self.world = None
+        self.ticks = 0
+
+    def reset(self, level=None, seed=None):
+        if level is not None:
+            self.level = level
+        if seed is not None:
+            self.seed = seed
+        self.world = ppc.new_world(self.level, self.seed)
+        self.ticks = 0
+        return self.observe()
+
+    def observe(self):
+        # Плоский кортеж чисел в порядке OBSERVATION; нет ключа или двери - -1
+        world = self.world
+        player = world.player
+        key, door = world.key, world.door
+        if world.projectiles is not None:
+            bullets = int((world.projectiles.kind[:world.projectiles.count] == ppc.PROJECTILE_BULLET).sum())
+        else:
+            bullets = len(world.bullets)
+        return (player.rect.centerx, player.rect.centery, player.health, player.score, world.current_level,
+                int(world.has_key), world.max_waves - world.current_waves, len(world.enemies), bullets,
+                key.rect.centerx if key else -1, key.rect.centery if key else -1,
+                door.rect.centerx if door else -1, door.rect.centery if door else -1)
+
+    def step(self, action):
+        move, target = action
+        # Спрайты обращаются к ppc.world, поэтому перед тиком делаем мир этого окружения активным
+        world = ppc.world = self.world
+        player = world.player
+        score, level, health = player.score, world.current_level, player.health
+        world.game_step(self.keys[move], (target,) if target is not None else ())
+        world.advance_time(self.dt)
+        self.ticks += 1
+        reward = (player.score - score) + LEVEL_REWARD * (world.current_level - level) - max(health - player.health, 0)
+        done = not world.running or self.ticks >= self.max_ticks
+        return self.observe(), reward, done
+
+    def summary(self):
+        world = self.world
+        return {"final_level": world.current_level, "health": world.player.health, "score": world.player.score,
+                "ticks": self.ticks, "won": world.won}
+
+
+# --- Несколько окружений в процессах ---
+def _serve(connection, configs):
+    # Процесс-исполнитель: держит свою долю окружений и отвечает на команды
+    # одним сообщением на всю долю. Закончившийся эпизод сразу начинается заново
+    envs = [GameEnv(**config) for config in configs]
+    while True:
+        command, payload = connection.recv()
+        if command == "reset":
+            connection.send([env.reset() for env in envs])
+        elif command == "step":
+            results = []
+            for env, action in zip(envs, payload):
+                observation, reward, done = env.step(action)
+                if done:
+                    observation = env.reset()
+                results.append((observation, reward, done))
+            connection.send(results)
+        elif command == "close":
+            connection.close()
+            return
+
+
+class VectorEnv:
+    # N независимых GameEnv, поровну разложенных по процессам (по умолчанию по
+    # числу ядер). Наблюдения, награды и флаги возвращаются списками в порядке configs
+    def __init__(self, configs, processes=None):
+        processes = max(1, min(processes or os.cpu_count() or 1, len(configs)))
+        self.count = len(configs)
+        self.bounds = [len(configs) * i // processes for i in range(processes + 1)]
+        self.connections = []
+        self.workers = []
+        for first, last in zip(self.bounds, self.bounds[1:]):
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_serve, args=(child, configs[first:last]), daemon=True)
+            worker.start()
+            child.close()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def reset(self):
+        for connection in self.connections:
+            connection.send(("reset", None))
+        return [observation for connection in self.connections for observation in connection.recv()]
+
+    def step(self, actions):
+        for connection, first, last in zip(self.connections, self.bounds, self.bounds[1:]):
+            connection.send(("step", actions[first:last]))
+        results = [result for connection in self.connections for result in connection.recv()]
+        observations, rewards, dones = zip(*results)
+        return list(observations), list(rewards), list(dones)
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+        for worker in self.workers:
+            worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- Целые эпизоды для балансировки ---
+def idle_policy(observation):
+    return 0, None
+
+
+def play_episode(config, policy=idle_policy):
+    # Один эпизод целиком внутри процесса, без обмена сообщениями на каждом тике
+    env = GameEnv(**config)
+    observation = env.reset()
+    total = 0
+    done = False
+    while not done:
+        observation, reward, done = env.step(policy(observation))
+        total += reward
+    return dict(config, reward=total, **env.summary())
+
+
+def evaluate(configs, policy=idle_policy, processes=None):
+    # policy должна быть функцией уровня модуля, чтобы её можно было передать в процесс.
+    # Пул закрываем через close/join: SDL в исполнителях перехватывает SIGTERM,
+    # поэтому terminate (выход из with) их не останавливает
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.starmap(play_episode, [(config, policy) for config in configs], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный прогон уровней Эхо-рыцаря без окна")
+    parser.add_argument("--levels", type=int, nargs="*", help="по умолчанию все уровни")
+    parser.add_argument("--seeds", type=int, default=4, help="сколько seed на уровень")
+    parser.add_argument("--ticks", type=int, default=ppc.FPS * 60, help="максимум тиков в эпизоде")
+    parser.add_argument("--processes", type=int, help="по умолчанию по числу ядер")
+    parser.add_argument("--out", help="куда записать результаты эпизодов в JSON")
+    args = parser.parse_args()
+
+    levels = args.levels if args.levels is not None else range(len(ppc.get_level_pack()))
+    configs = [{"level": level, "seed": seed, "max_ticks": args.ticks} for level in levels
+               for seed in range(args.seeds)]
+    start = time.perf_counter()
+    results = evaluate(configs, processes=args.processes)
+    elapsed = time.perf_counter() - start
+
+    for level in levels:
+        episodes = [result for result in results if result["level"] == level]
+        print(f"уровень {level + 1:2}: награда {sum(e['reward'] for e in episodes) / len(episodes):8.1f}  "
+              f"здоровье {sum(e['health'] for e in episodes) / len(episodes):6.1f}  "
+              f"пройден {sum(e['won'] or e['final_level'] > level for e in episodes)}/{len(episodes)}")
+    ticks = sum(result["ticks"] for result in results)
+    print(f"{len(results)} эпизодов, {ticks} тиков за {elapsed:.2f} с ({ticks / elapsed:.0f} тиков/с)")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
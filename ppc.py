@@ -2,27 +2,131 @@ import pygame
 import sys
 import random
 import json
+import struct
 import os
+import csv
+import time
+import math
+import atexit
+import threading
+import zlib
+import heapq
+import weakref
+import gc
+import bisect
+import tracemalloc
+from collections import OrderedDict, deque
+
+np = None  # numpy подгружается только для векторного движка снарядов, см. load_numpy
 
 SAVE_FILE = "progress.json"
 
+
+class ProgressStore:
+    # Прогресс держится в памяти, диск читается один раз. Запись идёт в фоновом
+    # потоке: несколько save подряд сливаются в одну запись последнего значения,
+    # файл пишется во временный и подменяется через os.replace, так что при
+    # падении посреди записи старый progress.json остаётся целым
+    def __init__(self, path):
+        self.path = path
+        self.progress = None
+        self.pending = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = None
+        atexit.register(self.close)
+
+    def load(self):
+        if self.progress is None:
+            self.progress = {"level": 0}
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):  # верный JSON, но не объект - тоже испорченный файл
+                    self.progress.update(data)
+            except (OSError, ValueError):  # нет файла или он испорчен - начинаем с нуля
+                pass
+        return self.progress
+
+    def save(self, **changes):
+        progress = self.load()
+        progress.update(changes)
+        with self.condition:
+            self.pending = dict(progress)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._writer, name="progress-writer", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def _writer(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                progress, self.pending = self.pending, None
+            try:
+                self._write(progress)
+            except OSError as e:
+                print(f"Не удалось сохранить прогресс: {e}", file=sys.stderr)
+
+    def _write(self, progress):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(progress, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def close(self):
+        # Дописывает то, что ещё в очереди, и останавливает поток; следующий
+        # save запустит новый
+        with self.condition:
+            thread, self.thread = self.thread, None
+            self.closed = True
+            self.condition.notify()
+        if thread is not None:
+            thread.join()
+        self.closed = False
+
+
+progress_store = ProgressStore(SAVE_FILE)
+
+
 def save_progress(level):
-    progress = {"level": level}
-    with open(SAVE_FILE, 'w') as f:
-        json.dump(progress, f)
+    progress_store.save(level=level)
+
 
 def load_progress():
-    if os.path.exists(SAVE_FILE):
-        with open(SAVE_FILE, 'r') as f:
-            progress = json.load(f)
-            return progress.get("level", 0)
-    return 0
+    return progress_store.load().get("level", 0)
+
 
-current_level = load_progress()
 # --- Основные настройки ---
-pygame.init()
+# Без окна: python ppc.py --headless (или ECHO_HEADLESS=1 при импорте)
+HEADLESS = os.environ.get("ECHO_HEADLESS") == "1"
 WIDTH, HEIGHT = 1000, 500
-FPS = 60
+FPS = 60  # шагов симуляции в секунду; скорости спрайтов заданы на шаг
+SIM_STEP = 1000 / FPS  # мс игрового времени на шаг
+# Отрисовка отвязана от симуляции: кадров в секунду не больше RENDER_FPS (0 - без
+# предела), и за кадр догоняется не больше MAX_CATCH_UP_STEPS шагов - если кадр
+# дольше, игра замедляется, а не уходит в бесконечное догоняние
+RENDER_FPS = 144
+MAX_CATCH_UP_STEPS = 5
+# Рисовать спрайты между двумя последними шагами симуляции, а не рывками по шагам
+INTERPOLATE = True
+# Чем рисовать: surface - программно в окно pygame.display, sdl2 - текстуры
+# pygame._sdl2 на видеокарте, sdl2-software - то же через программный
+# рендерер SDL (машины без GPU), null - ничего не рисовать
+RENDERER = os.environ.get("ECHO_RENDERER", "surface")
+# Полная сборка мусора только в безопасных точках (кадр после загрузки или
+# перезапуска уровня, пауза), а пережившее её замораживается gc.freeze - см. gc_safe_point
+GC_SAFE_POINTS = True
+# True: стены, ключ и дверь запекаются в фон, а на экран выводятся только
+# изменившиеся прямоугольники; False: полная перерисовка и flip каждый кадр
+DIRTY_RENDERING = True
+# Пули и волны считаются массивами numpy вместо отдельных спрайтов (если numpy установлен)
+NUMPY_PROJECTILES = False
 TITLE = "Эхо-рыцарь"
 TILE_SIZE = 50
 
@@ -36,44 +140,286 @@ GREEN = (50, 200, 50)
 ORANGE = (255, 165, 0)  # Стены, усиливающие звук
 PURPLE = (128, 0, 128)  # Стены, поглощающие звук
 
-player_health = 100
-player_score = 0
-max_waves = 5  # Ограничение на количество звуковых волн
-current_waves = 0
+MAX_WAVES = 5  # Ограничение на количество звуковых волн
+
+SCREEN_RECT = pygame.Rect(0, 0, WIDTH, HEIGHT)
+HUD_RECT = pygame.Rect(0, 0, 320, 130)  # область, которую занимает draw_ui
+
+# --- Отрисовка ---
+# Игра, интерфейс и меню рисуют через renderer. У всех бэкендов те же fill,
+# blit и blits, что у pygame.Surface, плюс present - показать кадр
+QUIT_EVENTS = (pygame.QUIT, pygame.WINDOWCLOSE)  # у sdl2 окно игры не последнее - ждём и закрытия окна
+
+
+class SurfaceRenderer:
+    # Программные блиты в поверхность окна. Кадр между present сохраняется,
+    # поэтому только этот бэкенд умеет обновлять экран по прямоугольникам
+    incremental = True
+
+    def __init__(self, surface):
+        self.surface = surface
+
+    def fill(self, color, rect=None):
+        self.surface.fill(color, rect)
+
+    def blit(self, source, dest, area=None):
+        self.surface.blit(source, dest, area)
+
+    def blits(self, sequence, doreturn=True):
+        return self.surface.blits(sequence, doreturn=doreturn)
+
+    def present(self, rects=None):
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
+
+class TextureRenderer:
+    # pygame._sdl2.video: каждое изображение загружается в текстуру при первой
+    # отрисовке и дальше рисуется с неё. Изображения и так общие на вид спрайта
+    # (solid_image, кадры волны, атлас игрока, чанки стен), поэтому текстура
+    # тоже одна на вид; уходит она вместе с изображением (слабые ссылки).
+    # Изображение, раз нарисованное через renderer, нельзя менять на месте
+    incremental = False
+
+    def __init__(self, software=False):
+        from pygame._sdl2 import video
+        self.window = video.Window(TITLE, (WIDTH, HEIGHT))
+        # accelerated=-1: видеокарта, а если её нет - программный рендерер SDL
+        self.renderer = video.Renderer(self.window, accelerated=0 if software else -1)
+        self.texture_class = video.Texture
+        self.textures = weakref.WeakKeyDictionary()
+
+    def texture(self, image):
+        texture = self.textures.get(image)
+        if texture is None:
+            texture = self.textures[image] = self.texture_class.from_surface(self.renderer, image)
+        return texture
+
+    def fill(self, color, rect=None):
+        self.renderer.draw_color = pygame.Color(color)
+        if rect is None:
+            self.renderer.clear()
+        else:
+            self.renderer.fill_rect(rect)
+
+    def blit(self, source, dest, area=None):
+        self.texture(source).draw(srcrect=area, dstrect=dest[:2])
+
+    def blits(self, sequence, doreturn=True):
+        texture = self.texture
+        for source, dest in sequence:
+            texture(source).draw(dstrect=dest[:2])
+        return []
+
+    def present(self, rects=None):
+        # После present содержимое кадра не определено - кадр всегда рисуется целиком
+        self.renderer.present()
+
+
+class NullRenderer:
+    incremental = False
+
+    def fill(self, color, rect=None):
+        pass
+
+    def blit(self, source, dest, area=None):
+        pass
+
+    def blits(self, sequence, doreturn=True):
+        return []
+
+    def present(self, rects=None):
+        pass
+
+
+RENDERERS = ("surface", "sdl2", "sdl2-software", "null")
+
+# Окно, часы, бэкенд отрисовки и текущий мир создаются при первом обращении, а не при импорте
+screen = None
+renderer = None
+clock = None
+world = None
+
+
+def init_display(backend=None):
+    global screen, renderer, clock
+    if screen is None:
+        if HEADLESS:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.init()
+        backend = backend or RENDERER
+        if backend == "surface":
+            screen = pygame.display.set_mode((WIDTH, HEIGHT))
+            pygame.display.set_caption(TITLE)
+            renderer = SurfaceRenderer(screen)
+        else:
+            # Окно pygame.display скрыто и нужно только для convert() изображений
+            screen = pygame.display.set_mode((1, 1), pygame.HIDDEN)
+            if backend == "null":
+                renderer = NullRenderer()
+            else:
+                renderer = TextureRenderer(software=backend == "sdl2-software")
+        clock = pygame.time.Clock()
+    return screen
+
+
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:  # векторный движок снарядов необязателен
+            return False
+        np = numpy
+    return True
+
+
+# --- Игровое время и таймеры ---
+class Timer:
+    # Запись в очереди GameClock; cancel() снимает таймер, не трогая кучу -
+    # снятые просто пропускаются, когда до них дойдёт очередь
+    def __init__(self, due, callback, period):
+        self.due = due
+        self.callback = callback
+        self.period = period
+        self.active = True
+
+    def cancel(self):
+        self.active = False
+
+
+class GameClock:
+    # Игровое время в мс и куча таймеров по сроку. Время идёт только через
+    # advance; настоящее время переводит в игровое scaled: на паузе игровое
+    # стоит, scale замедляет или ускоряет его. Спрайты не опрашивают часы
+    # каждый кадр, а ставят таймеры, и run_due вызывает только наступившие
+    def __init__(self):
+        self.time_ms = 0.0
+        self.scale = 1.0
+        self.paused = False
+        self.queue = []
+        self.counter = 0  # при равных сроках таймеры срабатывают в порядке постановки
+
+    def now(self):
+        return int(self.time_ms)
+
+    def scaled(self, real_ms):
+        return 0.0 if self.paused else real_ms * self.scale
+
+    def advance(self, dt):
+        self.time_ms += dt
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def schedule(self, delay, callback, period=None):
+        timer = Timer(self.now() + delay, callback, period)
+        self._push(timer)
+        return timer
+
+    def _push(self, timer):
+        heapq.heappush(self.queue, (timer.due, self.counter, timer))
+        self.counter += 1
+
+    def run_due(self):
+        # Периодический таймер после вызова встаёт на now + period: пропущенные
+        # из-за долгого кадра срабатывания не навёрстываются пачкой
+        now = self.now()
+        queue = self.queue
+        while queue and queue[0][0] <= now:
+            timer = heapq.heappop(queue)[2]
+            if not timer.active:
+                continue
+            if timer.period is not None:
+                timer.due = now + timer.period
+                self._push(timer)
+            else:
+                timer.active = False
+            timer.callback()
+
+    def clear(self):
+        for entry in self.queue:
+            entry[2].active = False
+        self.queue = []
+
+
+def game_time():
+    return world.clock.now()
 
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption(TITLE)
-clock = pygame.time.Clock()
 
 # --- Классы ---
 
-def load_animation_sprites(path, frame_count):
-    frames = []
-    for i in range(frame_count):
-        frame = pygame.image.load(f"{path}{i}.png").convert_alpha()
-        frames.append(frame)
-    return frames
+PLAYER_ANIMATIONS = {
+    "walk_down": ("sprites/walk_down_", 4),
+    "walk_up": ("sprites/walk_up_", 4),
+    "walk_left": ("sprites/walk_left_", 4),
+    "walk_right": ("sprites/walk_right_", 4),
+}
+PLAYER_ANIMATION_SPEED = 0.2
+atlas_cache = {}
+
+
+def load_animation_atlas(animations):
+    # Все кадры складываются в одну поверхность (анимация - строка атласа),
+    # а наружу отдаются подповерхности; с диска читается один раз на набор
+    cache_key = tuple(sorted(animations.items()))
+    if cache_key in atlas_cache:
+        return atlas_cache[cache_key]
+    images = {name: [pygame.image.load(f"{path}{i}.png") for i in range(frame_count)]
+              for name, (path, frame_count) in animations.items()}
+    width = max(sum(image.get_width() for image in frames) for frames in images.values())
+    height = sum(max(image.get_height() for image in frames) for frames in images.values())
+    atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+    rects = {}
+    y = 0
+    for name, frames in images.items():
+        x = 0
+        rects[name] = []
+        for image in frames:
+            atlas.blit(image, (x, y))
+            rects[name].append(pygame.Rect((x, y), image.get_size()))
+            x += image.get_width()
+        y += max(image.get_height() for image in frames)
+    atlas = atlas.convert_alpha()
+    result = {name: [atlas.subsurface(rect) for rect in frame_rects] for name, frame_rects in rects.items()}
+    atlas_cache[cache_key] = result
+    return result
+
+
+def build_timeline(frame_count, speed):
+    # Номер кадра на каждом шаге анимации: тот же дробный счёт, что раньше шёл
+    # в Player.update (индекс растёт на speed и обнуляется на frame_count)
+    timeline = [0]
+    index = 0
+    while True:
+        index += speed
+        if index >= frame_count:
+            return timeline
+        timeline.append(int(index))
 
 
-class Player(pygame.sprite.Sprite):
+class Player(pygame.sprite.DirtySprite):
     def __init__(self, x, y):
         super().__init__()
-        self.animations = {
-            "walk_down": load_animation_sprites("sprites/walk_down_", 4),
-            "walk_up": load_animation_sprites("sprites/walk_up_", 4),
-            "walk_left": load_animation_sprites("sprites/walk_left_", 4),
-            "walk_right": load_animation_sprites("sprites/walk_right_", 4),
-        }
+        self.animations = load_animation_atlas(PLAYER_ANIMATIONS)
+        self.timelines = {name: build_timeline(len(frames), PLAYER_ANIMATION_SPEED)
+                          for name, frames in self.animations.items()}
         self.current_animation = "walk_down"
         self.image = self.animations[self.current_animation][0]
         self.rect = self.image.get_rect()
         self.rect.topleft = (x, y)
-        self.frame_index = 0
-        self.animation_speed = 0.2
+        self.animation_step = 0
         self.velocity = 5
+        self.health = 100
+        self.score = 0
+        self.dirty = 2  # движущийся спрайт перерисовывается каждый кадр
 
-    def update(self):
-        keys = pygame.key.get_pressed()
+    def update(self, keys):
         if keys[pygame.K_LEFT]:
             self.rect.x -= self.velocity
             self.current_animation = "walk_left"
@@ -87,646 +433,2038 @@ class Player(pygame.sprite.Sprite):
             self.rect.y += self.velocity
             self.current_animation = "walk_down"
         else:
-            self.frame_index = 0
+            self.animation_step = 0
+
+        timeline = self.timelines[self.current_animation]
+        self.animation_step = (self.animation_step + 1) % len(timeline)
+        self.image = self.animations[self.current_animation][timeline[self.animation_step]]
+
+
+# --- Общие изображения и пулы ---
+# Все пули, стены, ключи и т.д. одного вида выглядят одинаково, поэтому
+# изображение одно на вид, уже в формате экрана. Его нельзя менять на месте
+solid_images = {}
+POOL_LIMIT = 512  # больше свободных экземпляров не держим
+
+
+def solid_image(width, height, color):
+    key = (width, height, color)
+    image = solid_images.get(key)
+    if image is None:
+        image = pygame.Surface((width, height)).convert()
+        image.fill(color)
+        solid_images[key] = image
+    return image
+
+
+class SpritePool:
+    # Свободные экземпляры одного класса: убитая пуля или волна попадает сюда
+    # и при следующем выстреле переиспользуется через reset вместо создания новой
+    def __init__(self, sprite_class, limit=POOL_LIMIT):
+        self.sprite_class = sprite_class
+        self.limit = limit
+        self.free = []
+
+    def acquire(self, *args):
+        if self.free:
+            sprite = self.free.pop()
+            sprite.reset(*args)
+            return sprite
+        return self.sprite_class(*args)
+
+    def release(self, sprite):
+        if len(self.free) < self.limit:
+            self.free.append(sprite)
+
+
+WAVE_GROWTH_TIME = 1000  # мс, за которые волна вырастает вдвое
+WAVE_GROWTH_STEPS = 32  # кадров в заранее нарисованной анимации роста
 
-        self.frame_index += self.animation_speed
-        if self.frame_index >= len(self.animations[self.current_animation]):
-            self.frame_index = 0
 
-        self.image = self.animations[self.current_animation][int(self.frame_index)]
+def build_wave_frames():
+    # Кадр k - круг для возраста волны k * WAVE_GROWTH_TIME / WAVE_GROWTH_STEPS.
+    # Каждый кадр рисуется с нуля, а не масштабированием предыдущего
+    frames = []
+    for step in range(WAVE_GROWTH_STEPS):
+        size = int(TILE_SIZE // 2 * (1 + step / WAVE_GROWTH_STEPS))
+        frame = pygame.Surface((size, size), pygame.SRCALPHA)
+        pygame.draw.circle(frame, YELLOW, (size // 2, size // 2), size // 2)
+        frames.append(frame.convert_alpha())
+    return frames
+
+
+wave_frames = None
+
 
+def get_wave_frames():
+    global wave_frames
+    if wave_frames is None:
+        wave_frames = build_wave_frames()
+    return wave_frames
 
-class Wave(pygame.sprite.Sprite):
-    def __init__(self, x, y, dx, dy):
+
+class Wave(pygame.sprite.DirtySprite):
+    def __init__(self, x, y, dx, dy, clock):
         super().__init__()
-        self.image = pygame.Surface((TILE_SIZE // 2, TILE_SIZE // 2), pygame.SRCALPHA)
-        pygame.draw.circle(self.image, YELLOW, (TILE_SIZE // 4, TILE_SIZE // 4), TILE_SIZE // 4)
+        self.image = get_wave_frames()[0]
         self.rect = self.image.get_rect(center=(x, y))
+        self.dirty = 2
+        self.reset(x, y, dx, dy, clock)
+
+    def reset(self, x, y, dx, dy, clock):
+        self.image = get_wave_frames()[0]
+        self.rect.size = self.image.get_size()
+        self.rect.center = (x, y)
         self.dx = dx
         self.dy = dy
-        self.spawn_time = pygame.time.get_ticks()
-
-    def update(self, walls, enemies):
-        self.rect.x += self.dx
-        self.rect.y += self.dy
-
-        # Анимация волны
-        current_time = pygame.time.get_ticks()
-        if current_time - self.spawn_time < 1000:  # 1 секунда
-            scale = 1 + (current_time - self.spawn_time) / 1000
-            self.image = pygame.transform.scale(self.image, (int(TILE_SIZE // 2 * scale), int(TILE_SIZE // 2 * scale)))
-            self.rect = self.image.get_rect(center=self.rect.center)
-
-        # Отскок от стен
-        for wall in walls:
-            if self.rect.colliderect(wall.rect):
-                if wall.absorption:
-                    self.kill()
-                else:
-                    if abs(self.rect.right - wall.rect.left) < 10 or abs(self.rect.left - wall.rect.right) < 10:
-                        self.dx = -self.dx
-                    if abs(self.rect.bottom - wall.rect.top) < 10 or abs(self.rect.top - wall.rect.bottom) < 10:
-                        self.dy = -self.dy
-                    if wall.amplification:
-                        self.dx *= 1.5
-                        self.dy *= 1.5
-
-        for enemy in enemies:
-            if self.rect.colliderect(enemy.rect):
-                player.score += 10  # Добавление очков за убийство врага
-                enemy.take_damage()
-                self.kill()
+        self.spawn_time = clock.now()
+        # Возраст нужен только пока волна растёт; конец роста отмечает таймер
+        self.growth = clock.schedule(WAVE_GROWTH_TIME, self.stop_growing)
+
+    def stop_growing(self):
+        self.growth = None
+
+    def kill(self):
+        # kill может прийти дважды за тик (стена и враг) - в пул кладём один раз
+        if self.alive():
+            if self.growth is not None:
+                self.growth.cancel()
+                self.growth = None
+            super().kill()
+            wave_pool.release(self)
+
+    def update(self, wall_grid, broadphase, area):
+        # Анимация волны: растём до движения, чтобы sweep видел уже новый размер
+        if self.growth is not None:
+            age = game_time() - self.spawn_time
+            frame = get_wave_frames()[age * WAVE_GROWTH_STEPS // WAVE_GROWTH_TIME]
+            if frame is not self.image:
+                rect = self.rect
+                place = wall_grid.fit(rect.x, rect.y, rect.w, rect.h, frame.get_width())
+                if place is not None:
+                    self.image = frame
+                    self.rect = self.image.get_rect(topleft=place)
+
+        # Движение с отскоками от стен; Rect округляет дробные координаты
+        rect = self.rect
+        x, y, self.dx, self.dy, kept = wall_grid.sweep(rect.x, rect.y, rect.w, rect.h, self.dx, self.dy, wave=True)
+        rect.x = x
+        rect.y = y
+        if not kept:
+            self.kill()
+            return
+
+        for enemy in broadphase.query("enemies", self.rect):
+            world.player.score += 10  # Добавление очков за убийство врага
+            enemy.take_damage()
+            self.kill()
+
+        # Улетевшая из активной области волна уже ни во что не попадёт
+        rect = self.rect
+        if rect.left > area.right or rect.right < area.left or rect.top > area.bottom or rect.bottom < area.top:
+            self.kill()
+
+
+wave_pool = SpritePool(Wave)
+
 
+ENEMY_SHOOT_PERIOD = 1000  # мс
 
-class Enemy(pygame.sprite.Sprite):
-    def __init__(self, x, y, health):
+
+class Enemy(pygame.sprite.DirtySprite):
+    def __init__(self, x, y, health, rng=random):
         super().__init__()
-        self.image = pygame.Surface((TILE_SIZE, TILE_SIZE))
-        self.image.fill(RED)
+        self.image = solid_image(TILE_SIZE, TILE_SIZE, RED)
         self.rect = self.image.get_rect(topleft=(x, y))
-        self.speed = random.choice([-1, 1]) * random.randint(1, 3)
-        self.shoot_timer = 0
+        self.speed = rng.choice([-1, 1]) * rng.randint(1, 3)
+        self.shoot_timer = None  # стреляет только проснувшийся враг
+        self.goal = None  # левый верхний угол клетки, в которую враг идёт за игроком
         self.health = health
+        self.dirty = 2
 
-    def update(self, walls):
-        self.rect.x += self.speed
-        if self.rect.left <= 0 or self.rect.right >= WIDTH or pygame.sprite.spritecollideany(self, walls):
+    def restore(self, topleft, speed, health):
+        self.rect.topleft = topleft
+        self.speed = speed
+        self.health = health
+        self.goal = None
+        self.shoot_timer = None
+
+    def wake(self, clock):
+        self.shoot_timer = clock.schedule(ENEMY_SHOOT_PERIOD, self.shoot, ENEMY_SHOOT_PERIOD)
+
+    def sleep(self):
+        if self.shoot_timer is not None:
+            self.shoot_timer.cancel()
+            self.shoot_timer = None
+
+    def kill(self):
+        self.sleep()
+        super().kill()
+
+    def update(self, wall_grid, flow):
+        # Игрок ближе CHASE_DISTANCE - идём к нему по полю направлений от клетки
+        # к клетке, иначе ходим влево-вправо до стены
+        rect = self.rect
+        if self.goal is None or rect.topleft == self.goal:
+            self.goal = self.next_goal(flow)
+        if self.goal is not None:
+            speed = abs(self.speed)
+            goal_x, goal_y = self.goal
+            rect.x += max(-speed, min(speed, goal_x - rect.x))
+            rect.y += max(-speed, min(speed, goal_y - rect.y))
+            return
+
+        rect.x += self.speed
+        if rect.left <= 0 or rect.right >= wall_grid.width or wall_grid.collides(rect):
             self.speed = -self.speed
 
-        if pygame.time.get_ticks() - self.shoot_timer > 1000:
-            bullet = Bullet(self.rect.centerx, self.rect.centery, random.choice([-5, 5]), random.choice([-5, 5]))
-            all_sprites.add(bullet)
-            bullets.add(bullet)
-            self.shoot_timer = pygame.time.get_ticks()
+    def next_goal(self, flow):
+        rect = self.rect
+        col, row = rect.centerx // TILE_SIZE, rect.centery // TILE_SIZE
+        direction = flow.direction(col, row)
+        if direction is None:
+            return None
+        x, y = col * TILE_SIZE, row * TILE_SIZE
+        if rect.topleft != (x, y):
+            return x, y  # сначала встаём ровно в свою клетку: тогда путь до соседней свободен
+        dc, dr = direction
+        return x + dc * TILE_SIZE, y + dr * TILE_SIZE
+
+    def shoot(self):
+        rng = world.rng
+        world.spawn_bullet(self.rect.centerx, self.rect.centery, rng.choice([-5, 5]), rng.choice([-5, 5]))
 
     def take_damage(self):
         self.health -= 1
         if self.health <= 0:
-            player.score += 10  # Добавление очков за убийство врага
+            world.player.score += 10  # Добавление очков за убийство врага
             self.kill()
 
 
-class Bullet(pygame.sprite.Sprite):
-    def __init__(self, x, y, dx, dy):
+BULLET_SIZE = TILE_SIZE // 4
+BULLET_LIFETIME = 3000  # мс
+
+
+class Bullet(pygame.sprite.DirtySprite):
+    def __init__(self, x, y, dx, dy, clock):
         super().__init__()
-        self.image = pygame.Surface((TILE_SIZE // 4, TILE_SIZE // 4))
-        self.image.fill(WHITE)
+        self.image = solid_image(BULLET_SIZE, BULLET_SIZE, WHITE)
         self.rect = self.image.get_rect(center=(x, y))
+        self.dirty = 2
+        self.reset(x, y, dx, dy, clock)
+
+    def reset(self, x, y, dx, dy, clock):
+        self.rect.center = (x, y)
         self.dx = dx
         self.dy = dy
-        self.spawn_time = pygame.time.get_ticks()
+        self.expiry = clock.schedule(BULLET_LIFETIME, self.kill)  # удаление пули спустя время
 
-    def update(self, walls):
-        self.rect.x += self.dx
-        self.rect.y += self.dy
+    def kill(self):
+        if self.alive():
+            self.expiry.cancel()
+            super().kill()
+            bullet_pool.release(self)
 
-        # Удаление пули спустя время
-        if pygame.time.get_ticks() - self.spawn_time > 3000:  # 3 секунды
-            self.kill()
-
-        for wall in walls:
-            if self.rect.colliderect(wall.rect):
-                if abs(self.rect.right - wall.rect.left) < 10 or abs(self.rect.left - wall.rect.right) < 10:
-                    self.dx = -self.dx
-                if abs(self.rect.bottom - wall.rect.top) < 10 or abs(self.rect.top - wall.rect.bottom) < 10:
-                    self.dy = -self.dy
+    def update(self, wall_grid, area):
+        rect = self.rect
+        x, y, self.dx, self.dy, _ = wall_grid.sweep(rect.x, rect.y, rect.w, rect.h, self.dx, self.dy)
+        rect.x = x
+        rect.y = y
 
-        if self.rect.left > WIDTH or self.rect.right < 0 or self.rect.top > HEIGHT or self.rect.bottom < 0:
+        if rect.left > area.right or rect.right < area.left or rect.top > area.bottom or rect.bottom < area.top:
             self.kill()
 
 
-class Wall(pygame.sprite.Sprite):
-    def __init__(self, x, y, width, height, absorption=False, amplification=False):
-        super().__init__()
-        self.image = pygame.Surface((width, height))
-        if absorption:
-            self.image.fill(PURPLE)
-        elif amplification:
-            self.image.fill(ORANGE)
+bullet_pool = SpritePool(Bullet)
+
+
+# --- Сетка стен и камера ---
+WALL_CODES = {"W": 1, "A": 2, "P": 3}
+WALL_TILES = {code: tile for tile, code in WALL_CODES.items()}
+WALL_COLORS = {WALL_CODES["W"]: GRAY, WALL_CODES["A"]: ORANGE, WALL_CODES["P"]: PURPLE}
+CHUNK_TILES = 8  # клеток в стороне чанка
+CHUNK_SIZE = CHUNK_TILES * TILE_SIZE
+CHUNK_CACHE_SIZE = 32  # отрисованных чанков в памяти; экран закрывают не больше 12
+ACTIVE_MARGIN = CHUNK_SIZE  # полоса вокруг экрана, где враги не спят, а снаряды живут
+SWEEP_MAX_CONTACTS = 8  # столкновений со стенами за один шаг снаряда
+SWEEP_EPSILON = 1e-6
+WAVE_MAX_SPEED = TILE_SIZE * 4  # пикселей за шаг после усиливающих стен
+
+
+def crosses_tile_line(pos, size, motion):
+    # Пересекает ли передняя грань отрезка [pos, pos + size) границу клеток при сдвиге на motion
+    if motion > 0:
+        return math.ceil((pos + size - SWEEP_EPSILON) / TILE_SIZE) * TILE_SIZE <= pos + size + motion
+    if motion < 0:
+        return math.floor((pos + SWEEP_EPSILON) / TILE_SIZE) * TILE_SIZE >= pos + motion
+    return False
+
+
+class TileGrid:
+    # Статическая сетка стен уровня, разбитая на чанки CHUNK_TILES x CHUNK_TILES
+    # клеток. Чанк - bytearray кодов стен (WALL_CODES, 0 - пусто) по строкам;
+    # чанков без стен в словаре нет, так что пустые области памяти не занимают.
+    # Изображения чанков рисуются при первом показе и живут в LRU-кеше
+    def __init__(self, cols, rows):
+        self.cols = cols
+        self.rows = rows
+        self.width = cols * TILE_SIZE
+        self.height = rows * TILE_SIZE
+        self.chunks = {}
+        self.wall_count = 0
+        self.images = OrderedDict()
+
+    @classmethod
+    def from_cells(cls, cols, rows, cells):
+        # cells - коды стен всей карты по строкам, как в CompiledLayout
+        grid = cls(cols, rows)
+        for cy in range(0, rows, CHUNK_TILES):
+            lines = [cells[row * cols:(row + 1) * cols] for row in range(cy, min(cy + CHUNK_TILES, rows))]
+            for cx in range(0, cols, CHUNK_TILES):
+                parts = [line[cx:cx + CHUNK_TILES] for line in lines]
+                if not any(any(part) for part in parts):
+                    continue
+                chunk = bytearray(CHUNK_TILES * CHUNK_TILES)
+                for i, part in enumerate(parts):
+                    chunk[i * CHUNK_TILES:i * CHUNK_TILES + len(part)] = part
+                grid.chunks[cx // CHUNK_TILES, cy // CHUNK_TILES] = chunk
+                grid.wall_count += CHUNK_TILES * CHUNK_TILES - chunk.count(0)
+        return grid
+
+    def code_at(self, col, row):
+        chunk = self.chunks.get((col // CHUNK_TILES, row // CHUNK_TILES))
+        if chunk is None:
+            return 0
+        return chunk[row % CHUNK_TILES * CHUNK_TILES + col % CHUNK_TILES]
+
+    def collides(self, rect):
+        left = max(rect.left // TILE_SIZE, 0)
+        right = min((rect.right - 1) // TILE_SIZE, self.cols - 1)
+        top = max(rect.top // TILE_SIZE, 0)
+        bottom = min((rect.bottom - 1) // TILE_SIZE, self.rows - 1)
+        for row in range(top, bottom + 1):
+            for col in range(left, right + 1):
+                if self.code_at(col, row):
+                    return True
+        return False
+
+    def fit(self, x, y, w, h, size):
+        # Куда поставить квадрат size, выросший из прямоугольника (x, y, w, h):
+        # по центру, а если так он заходит в стену - прижатым к краям старого.
+        # None - места нет, пусть остаётся прежнего размера. Иначе рост на
+        # пиксель вдавливает переднюю грань в стену, и sweep её уже не видит
+        centered_x, centered_y = x + w // 2 - size // 2, y + h // 2 - size // 2
+        for left in (centered_x, x, x + w - size):
+            for top in (centered_y, y, y + h - size):
+                if not self.collides(pygame.Rect(left, top, size, size)):
+                    return left, top
+        return None
+
+    def chunks_in_rect(self, rect):
+        # Чанки со стенами, которые задевает rect (в пикселях)
+        for cy in range(max(rect.top // CHUNK_SIZE, 0), (rect.bottom - 1) // CHUNK_SIZE + 1):
+            for cx in range(max(rect.left // CHUNK_SIZE, 0), (rect.right - 1) // CHUNK_SIZE + 1):
+                if (cx, cy) in self.chunks:
+                    yield cx, cy
+
+    def chunk_image(self, cx, cy):
+        image = self.images.get((cx, cy))
+        if image is not None:
+            self.images.move_to_end((cx, cy))
+            return image
+        image = pygame.Surface((CHUNK_SIZE, CHUNK_SIZE)).convert()
+        image.fill(BLACK)
+        chunk = self.chunks[cx, cy]
+        for index, code in enumerate(chunk):
+            if code:
+                row, col = divmod(index, CHUNK_TILES)
+                image.fill(WALL_COLORS[code], (col * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+        self.images[cx, cy] = image
+        if len(self.images) > CHUNK_CACHE_SIZE:
+            self.images.popitem(last=False)
+        return image
+
+    def draw(self, surface, view):
+        # Стены, видимые в прямоугольнике view (в координатах мира); пустые места не трогаем
+        surface.blits([(self.chunk_image(cx, cy), (cx * CHUNK_SIZE - view.x, cy * CHUNK_SIZE - view.y))
+                       for cx, cy in list(self.chunks_in_rect(view))], doreturn=False)
+
+    def sweep(self, x, y, w, h, dx, dy, wave=False):
+        # Непрерывное движение прямоугольника на (dx, dy) за один шаг: ищем
+        # первый вход в клетку со стеной, отражаем скорость в этот момент и
+        # проходим остаток пути уже с новой скоростью. Так быстрый снаряд не
+        # пролетает сквозь стену и не отскакивает от одной стены дважды.
+        # Возвращает x, y, dx, dy и False, если волну поглотила стена
+        if not (crosses_tile_line(x, w, dx) or crosses_tile_line(y, h, dy)):
+            return x + dx, y + dy, dx, dy, True  # за шаг не вошли ни в одну новую клетку
+        remaining = 1.0
+        for _ in range(SWEEP_MAX_CONTACTS):
+            contact = self.first_contact(x, y, w, h, dx * remaining, dy * remaining)
+            if contact is None:
+                return x + dx * remaining, y + dy * remaining, dx, dy, True
+            t, flip_x, flip_y, kinds = contact
+            x += dx * remaining * t
+            y += dy * remaining * t
+            remaining *= 1 - t
+            if wave and WALL_CODES["P"] in kinds:
+                return x, y, dx, dy, False
+            if flip_x:
+                dx = -dx
+            if flip_y:
+                dy = -dy
+            if wave and WALL_CODES["A"] in kinds:
+                # Усиление не больше WAVE_MAX_SPEED, иначе скорость растёт без предела
+                boost = min(1.5, WAVE_MAX_SPEED / math.hypot(dx, dy))
+                dx *= boost
+                dy *= boost
+        return x, y, dx, dy, True  # остаток пути после стольких отскоков отбрасываем
+
+    def first_contact(self, x, y, w, h, mx, my):
+        # Момент t из [0, 1], когда прямоугольник, сдвигаясь на (mx, my),
+        # впервые входит в клетку со стеной; по какой оси отражаться и коды стен.
+        # Клетки, которые прямоугольник уже перекрывает, не считаются
+        hit_x = self._axis_contact(x, w, mx, y, h, my, True)
+        hit_y = self._axis_contact(y, h, my, x, w, mx, False)
+        if hit_x is None and hit_y is None:
+            return None
+        if hit_y is None or (hit_x is not None and hit_x[0] < hit_y[0] - SWEEP_EPSILON):
+            return hit_x[0], True, False, hit_x[1]
+        if hit_x is None or hit_y[0] < hit_x[0] - SWEEP_EPSILON:
+            return hit_y[0], False, True, hit_y[1]
+        return hit_x[0], True, True, hit_x[1] + hit_y[1]  # угол: обе оси сразу
+
+    def _axis_contact(self, pos, size, motion, other, other_size, other_motion, along_x):
+        # Перебор границ клеток вдоль одной оси в порядке пересечения передней
+        # гранью; на каждой проверяем клетки, которые в этот момент занимает
+        # прямоугольник по другой оси
+        if not motion:
+            return None
+        count, other_count = (self.cols, self.rows) if along_x else (self.rows, self.cols)
+        if motion > 0:
+            edge = pos + size
+            line = math.ceil((edge - SWEEP_EPSILON) / TILE_SIZE)
         else:
-            self.image.fill(GRAY)
-        self.rect = self.image.get_rect(topleft=(x, y))
-        self.absorption = absorption
-        self.amplification = amplification
-
-
-class Key(pygame.sprite.Sprite):
+            edge = pos
+            line = math.floor((edge + SWEEP_EPSILON) / TILE_SIZE)
+        step = 1 if motion > 0 else -1
+        while True:
+            t = max((line * TILE_SIZE - edge) / motion, 0.0)
+            if t > 1:
+                return None
+            tile = line if motion > 0 else line - 1
+            if tile >= count if motion > 0 else tile < 0:
+                return None
+            if 0 <= tile < count:
+                first, last = self._span(other + other_motion * t, other_size, other_motion, other_count)
+                code_at = self.code_at
+                if along_x:
+                    kinds = [code for code in (code_at(tile, row) for row in range(first, last + 1)) if code]
+                else:
+                    kinds = [code for code in (code_at(col, tile) for col in range(first, last + 1)) if code]
+                if kinds:
+                    return t, kinds
+            line += step
+
+    def _span(self, start, size, motion, count):
+        # Клетки под отрезком [start, start + size); край, который ровно на
+        # границе и движется через неё, уже считается в соседней клетке
+        first = int((start - SWEEP_EPSILON if motion < 0 else start + SWEEP_EPSILON) // TILE_SIZE)
+        last = int((start + size + SWEEP_EPSILON if motion > 0 else start + size - SWEEP_EPSILON) // TILE_SIZE)
+        return max(first, 0), min(last, count - 1)
+
+
+class Camera:
+    # Окно экрана в координатах мира: держит игрока по центру, но не выходит
+    # за карту. Карта не больше экрана не прокручивается и лежит в левом верхнем углу
+    def __init__(self, map_width, map_height):
+        self.bounds = pygame.Rect(0, 0, max(map_width, WIDTH), max(map_height, HEIGHT))
+        self.view = pygame.Rect(0, 0, WIDTH, HEIGHT)
+        self.scrolls = self.bounds.size != self.view.size
+
+    def follow(self, rect):
+        self.view.x = min(max(rect.centerx - WIDTH // 2, 0), self.bounds.width - WIDTH)
+        self.view.y = min(max(rect.centery - HEIGHT // 2, 0), self.bounds.height - HEIGHT)
+
+    def active_area(self):
+        # Где враги не спят и снаряды живут: экран с полосой ACTIVE_MARGIN, в пределах карты
+        return self.view.inflate(2 * ACTIVE_MARGIN, 2 * ACTIVE_MARGIN).clip(self.bounds)
+
+    def to_world(self, pos):
+        return pos[0] + self.view.x, pos[1] + self.view.y
+
+
+class SpatialHash:
+    # Пространственный хеш подвижных спрайтов. Каждая группа раз в кадр
+    # раскладывается по клеткам cell_size x cell_size, и запрос возвращает
+    # только соседей, причём в том же порядке, в каком их обходит сама группа
+    def __init__(self, cell_size=TILE_SIZE * 2):
+        self.cell_size = cell_size
+        self.layers = {}
+
+    def _cells(self, rect):
+        size = self.cell_size
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def rebuild(self, **groups):
+        self.layers = {}
+        for name, group in groups.items():
+            buckets = {}
+            for order, sprite in enumerate(group):
+                for cell in self._cells(sprite.rect):
+                    buckets.setdefault(cell, []).append((order, sprite))
+            self.layers[name] = (group, buckets)
+
+    def query(self, name, rect):
+        group, buckets = self.layers[name]
+        candidates = {}
+        for cell in self._cells(rect):
+            for order, sprite in buckets.get(cell, ()):
+                candidates[order] = sprite
+        # Спрайты, убитые после перестройки, пропускаем
+        return [candidates[order] for order in sorted(candidates)
+                if group.has(candidates[order]) and rect.colliderect(candidates[order].rect)]
+
+
+# --- Поле направлений к игроку ---
+CHASE_DISTANCE = 12  # клеток пути, с которых враг замечает игрока и идёт к нему
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+class FlowField:
+    # Общее для всех врагов поле расстояний: BFS по свободным клеткам от клетки
+    # игрока на глубину CHASE_DISTANCE. Пересчитывается, только когда игрок
+    # переходит в другую клетку, и стоит не больше ~2 * CHASE_DISTANCE^2 клеток
+    # при любом размере карты и числе врагов; враг читает свой шаг за O(1)
+    def __init__(self, wall_grid):
+        self.wall_grid = wall_grid
+        self.target = None
+        self.distance = {}
+
+    def update(self, rect):
+        target = (rect.centerx // TILE_SIZE, rect.centery // TILE_SIZE)
+        if target == self.target:
+            return
+        self.target = target
+        grid = self.wall_grid
+        distance = {target: 0}
+        frontier = deque([target])
+        while frontier:
+            col, row = frontier.popleft()
+            steps = distance[col, row] + 1
+            if steps > CHASE_DISTANCE:
+                break
+            for dc, dr in NEIGHBOURS:
+                cell = (col + dc, row + dr)
+                if (cell not in distance and 0 <= cell[0] < grid.cols and 0 <= cell[1] < grid.rows
+                        and not grid.code_at(*cell)):
+                    distance[cell] = steps
+                    frontier.append(cell)
+        self.distance = distance
+
+    def direction(self, col, row):
+        # Шаг к соседней клетке ближе к игроку: (0, 0) - враг уже рядом с игроком
+        # или в его клетке, None - игрок дальше CHASE_DISTANCE или недостижим
+        steps = self.distance.get((col, row))
+        if steps is None:
+            return None
+        for dc, dr in NEIGHBOURS:
+            cell = (col + dc, row + dr)
+            if self.distance.get(cell) == steps - 1:
+                # Игрок ходит сквозь стены - в стену за ним не идём
+                if cell == self.target and self.wall_grid.code_at(*cell):
+                    return 0, 0
+                return dc, dr
+        return 0, 0
+
+
+# --- Векторный движок снарядов ---
+PROJECTILE_BULLET = 0
+PROJECTILE_WAVE = 1
+PROJECTILE_DIRTY_LIMIT = 64  # больше прямоугольников - проще перерисовать экран целиком
+
+
+def round_half_away(values):
+    # Так же, как pygame.Rect округляет присвоенные дробные координаты
+    return np.copysign(np.floor(np.abs(values) + 0.5), values).astype(np.int64)
+
+
+class ProjectileSystem:
+    # Пули и волны в виде структуры массивов: позиция и размер прямоугольника,
+    # скорость, время появления, вид и кадр анимации. Правила те же, что в
+    # Bullet.update и Wave.update, но весь шаг делается разом над массивами
+    FIELDS = (("x", "i8"), ("y", "i8"), ("w", "i8"), ("h", "i8"), ("dx", "f8"), ("dy", "f8"),
+              ("spawn_time", "i8"), ("kind", "i1"), ("frame", "i8"), ("prev_x", "i8"), ("prev_y", "i8"))
+
+    def __init__(self, capacity=256):
+        self.count = 0
+        self.capacity = capacity
+        for name, dtype in self.FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        self.wall_grid = None
+        self.wall_sums = np.zeros((1, 1), dtype=np.int32)
+        self.wave_frames = get_wave_frames()
+        self.wave_sizes = np.array([frame.get_width() for frame in self.wave_frames], dtype=np.int64)
+        self.bullet_image = solid_image(BULLET_SIZE, BULLET_SIZE, WHITE)
+        self.drawn_rects = []
+
+    def reset(self, wall_grid):
+        self.count = 0
+        if wall_grid is self.wall_grid:
+            return  # перезапуск того же уровня - стены и таблица сумм те же
+        self.wall_grid = wall_grid
+        # Таблица сумм: число стен в любом прямоугольнике клеток за четыре чтения
+        solid = np.zeros((wall_grid.rows, wall_grid.cols), dtype=np.int32)
+        for (cx, cy), chunk in wall_grid.chunks.items():
+            part = solid[cy * CHUNK_TILES:(cy + 1) * CHUNK_TILES, cx * CHUNK_TILES:(cx + 1) * CHUNK_TILES]
+            block = np.frombuffer(chunk, dtype=np.uint8).reshape(CHUNK_TILES, CHUNK_TILES)
+            part[:] = block[:part.shape[0], :part.shape[1]] > 0
+        self.wall_sums = np.zeros((wall_grid.rows + 1, wall_grid.cols + 1), dtype=np.int32)
+        self.wall_sums[1:, 1:] = solid.cumsum(axis=0).cumsum(axis=1)
+
+    def _near_walls(self, x, y, w, h, dx, dy):
+        # Снаряды, чей путь за шаг задевает хоть одну клетку со стеной; остальные
+        # просто сдвигаются, а эти считаются через TileGrid.sweep
+        rows, cols = self.wall_sums.shape[0] - 1, self.wall_sums.shape[1] - 1
+        col0 = np.clip(np.floor(np.minimum(x, x + dx) / TILE_SIZE), 0, cols - 1).astype(np.int64)
+        col1 = np.clip(np.floor(np.maximum(x + w, x + w + dx) / TILE_SIZE), 0, cols - 1).astype(np.int64)
+        row0 = np.clip(np.floor(np.minimum(y, y + dy) / TILE_SIZE), 0, rows - 1).astype(np.int64)
+        row1 = np.clip(np.floor(np.maximum(y + h, y + h + dy) / TILE_SIZE), 0, rows - 1).astype(np.int64)
+        sums = self.wall_sums
+        walls = sums[row1 + 1, col1 + 1] - sums[row0, col1 + 1] - sums[row1 + 1, col0] + sums[row0, col0]
+        return np.flatnonzero(walls > 0)
+
+    def _grow(self):
+        self.capacity *= 2
+        for name, dtype in self.FIELDS:
+            array = np.zeros(self.capacity, dtype=dtype)
+            array[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, array)
+
+    def spawn(self, kind, x, y, dx, dy):
+        if self.count == self.capacity:
+            self._grow()
+        size = BULLET_SIZE if kind == PROJECTILE_BULLET else int(self.wave_sizes[0])
+        i = self.count
+        # Как get_rect(center=(x, y))
+        self.x[i] = self.prev_x[i] = x - size // 2
+        self.y[i] = self.prev_y[i] = y - size // 2
+        self.w[i] = self.h[i] = size
+        self.dx[i] = dx
+        self.dy[i] = dy
+        self.spawn_time[i] = game_time()
+        self.kind[i] = kind
+        self.frame[i] = 0
+        self.count += 1
+
+    def _keep(self, mask):
+        kept = int(mask.sum())
+        n = self.count
+        for name, _ in self.FIELDS:
+            array = getattr(self, name)
+            array[:kept] = array[:n][mask]
+        self.count = kept
+
+    def step(self, broadphase, area):
+        n = self.count
+        if n == 0:
+            return
+        x, y, w, h = self.x[:n], self.y[:n], self.w[:n], self.h[:n]
+        dx, dy, frame = self.dx[:n], self.dy[:n], self.frame[:n]
+        is_wave = self.kind[:n] == PROJECTILE_WAVE
+        is_bullet = ~is_wave
+        age = game_time() - self.spawn_time[:n]
+
+        alive = ~(is_bullet & (age >= BULLET_LIFETIME))  # как таймер пули: срок наступил - пули нет
+
+        # Рост волны до движения, как у Wave: кадр по возрасту, прямоугольник от
+        # центра, а у стены - через TileGrid.fit
+        growing = is_wave & (age < WAVE_GROWTH_TIME)
+        if growing.any():
+            grown = frame.copy()
+            grown[growing] = age[growing] * WAVE_GROWTH_STEPS // WAVE_GROWTH_TIME
+            changed = np.flatnonzero(grown != frame)
+            size = self.wave_sizes[grown[changed]]
+            new_x = x[changed] + w[changed] // 2 - size // 2
+            new_y = y[changed] + h[changed] // 2 - size // 2
+            fits = np.ones(len(changed), dtype=bool)
+            for j in self._near_walls(new_x, new_y, size, size, 0, 0).tolist():
+                i = int(changed[j])
+                place = self.wall_grid.fit(int(x[i]), int(y[i]), int(w[i]), int(h[i]), int(size[j]))
+                if place is None:
+                    fits[j] = False
+                else:
+                    new_x[j], new_y[j] = place
+            changed = changed[fits]
+            frame[changed] = grown[changed]
+            x[changed] = new_x[fits]
+            y[changed] = new_y[fits]
+            w[changed] = h[changed] = size[fits]
+
+        new_x, new_y = x + dx, y + dy
+        sweep = self.wall_grid.sweep
+        for i in self._near_walls(x, y, w, h, dx, dy).tolist():
+            new_x[i], new_y[i], dx[i], dy[i], kept = sweep(int(x[i]), int(y[i]), int(w[i]), int(h[i]),
+                                                           float(dx[i]), float(dy[i]), wave=bool(is_wave[i]))
+            if not kept:
+                alive[i] = False
+        x[:] = round_half_away(new_x)
+        y[:] = round_half_away(new_y)
+
+        right, bottom = x + w, y + h
+
+        # Волн немного, столкновения с врагами разбираются по одной, в порядке появления
+        for i in np.flatnonzero(is_wave & alive).tolist():
+            rect = pygame.Rect(int(x[i]), int(y[i]), int(w[i]), int(h[i]))
+            for enemy in broadphase.query("enemies", rect):
+                world.player.score += 10  # Добавление очков за убийство врага
+                enemy.take_damage()
+                alive[i] = False
+
+        alive &= (x <= area.right) & (right >= area.left) & (y <= area.bottom) & (bottom >= area.top)
+        if not alive.all():
+            self._keep(alive)
+
+    def take_hits(self, rect):
+        # Сколько пуль попало в rect; попавшие пули исчезают
+        n = self.count
+        x, y = self.x[:n], self.y[:n]
+        hit = ((self.kind[:n] == PROJECTILE_BULLET) & (x < rect.right) & (x + self.w[:n] > rect.left)
+               & (y < rect.bottom) & (y + self.h[:n] > rect.top))
+        hits = int(hit.sum())
+        if hits:
+            self._keep(~hit)
+        return hits
+
+    def remember(self):
+        n = self.count
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
+
+    def draw(self, target, offset=(0, 0), alpha=1.0):
+        n = self.count
+        bullet_image, wave_frames = self.bullet_image, self.wave_frames
+        images = [bullet_image if kind == PROJECTILE_BULLET else wave_frames[frame]
+                  for kind, frame in zip(self.kind[:n].tolist(), self.frame[:n].tolist())]
+        x, y = self.x[:n], self.y[:n]
+        if alpha < 1.0:
+            x = round_half_away(self.prev_x[:n] + (x - self.prev_x[:n]) * alpha)
+            y = round_half_away(self.prev_y[:n] + (y - self.prev_y[:n]) * alpha)
+        xs = (x + offset[0]).tolist()
+        ys = (y + offset[1]).tolist()
+        self.drawn_rects = target.blits(list(zip(images, zip(xs, ys))))
+        return self.drawn_rects
+
+
+class Key(pygame.sprite.DirtySprite):
     def __init__(self, x, y):
         super().__init__()
-        self.image = pygame.Surface((TILE_SIZE, TILE_SIZE))
-        self.image.fill(YELLOW)
+        self.image = solid_image(TILE_SIZE, TILE_SIZE, YELLOW)
         self.rect = self.image.get_rect(topleft=(x, y))
 
 
-class Door(pygame.sprite.Sprite):
+class Door(pygame.sprite.DirtySprite):
     def __init__(self, x, y):
         super().__init__()
-        self.image = pygame.Surface((TILE_SIZE, TILE_SIZE))
-        self.image.fill(GREEN)
+        self.image = solid_image(TILE_SIZE, TILE_SIZE, GREEN)
         self.rect = self.image.get_rect(topleft=(x, y))
 
 
-class HealthPack(pygame.sprite.Sprite):
+class HealthPack(pygame.sprite.DirtySprite):
     def __init__(self, x, y):
         super().__init__()
-        self.image = pygame.Surface((TILE_SIZE, TILE_SIZE))
-        self.image.fill(GREEN)
+        self.image = solid_image(TILE_SIZE, TILE_SIZE, GREEN)
         self.rect = self.image.get_rect(topleft=(x, y))
 
 
-class Bonus(pygame.sprite.Sprite):
+class Bonus(pygame.sprite.DirtySprite):
     def __init__(self, x, y):
         super().__init__()
-        self.image = pygame.Surface((TILE_SIZE, TILE_SIZE))
-        self.image.fill(BLUE)
+        self.image = solid_image(TILE_SIZE, TILE_SIZE, BLUE)
         self.rect = self.image.get_rect(topleft=(x, y))
 
 
+# --- Пакет уровней ---
+# levels/source.txt - исходные карты, levels/manifest.json + levels/layouts.bin -
+# собранный пакет. Одинаковые карты хранятся один раз, каждая уже разобрана
+# в сетку стен и список появления объектов и читается с диска только при входе
+SPAWN_TILES = "EBKDHX"
+LAYOUT_HEADER = struct.Struct("<HHH")  # столбцы, строки, число объектов
+LAYOUT_SPAWN = struct.Struct("<cHH")  # тайл, столбец, строка
+LAYOUT_CACHE_SIZE = 4
+
+
+class CompiledLayout:
+    def __init__(self, cols, rows, cells, spawns):
+        self.cols = cols
+        self.rows = rows
+        self.cells = cells  # bytes, коды WALL_CODES по строкам, 0 - пусто
+        self.spawns = spawns  # [(тайл, столбец, строка)] по строкам
+
+    def pack(self):
+        data = [LAYOUT_HEADER.pack(self.cols, self.rows, len(self.spawns)), self.cells]
+        data.extend(LAYOUT_SPAWN.pack(tile.encode(), col, row) for tile, col, row in self.spawns)
+        return b"".join(data)
+
+    @classmethod
+    def unpack(cls, data):
+        cols, rows, spawn_count = LAYOUT_HEADER.unpack_from(data)
+        offset = LAYOUT_HEADER.size
+        cells = bytes(data[offset:offset + cols * rows])
+        offset += cols * rows
+        spawns = [(tile.decode(), col, row) for tile, col, row
+                  in LAYOUT_SPAWN.iter_unpack(data[offset:offset + spawn_count * LAYOUT_SPAWN.size])]
+        return cls(cols, rows, cells, spawns)
+
+
+def compile_layout(level_map):
+    cols, rows = max(len(row) for row in level_map), len(level_map)
+    cells = bytearray(cols * rows)
+    spawns = []
+    for row_idx, row in enumerate(level_map):
+        for col_idx, tile in enumerate(row):
+            if tile in WALL_CODES:
+                cells[row_idx * cols + col_idx] = WALL_CODES[tile]
+            elif tile in SPAWN_TILES:
+                spawns.append((tile, col_idx, row_idx))
+    return CompiledLayout(cols, rows, bytes(cells), spawns)
+
+
+def read_level_source(path):
+    # Карты из текстового файла: уровни разделены пустыми строками, # - комментарий
+    level_maps, current = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("#"):
+                continue
+            if line.strip():
+                current.append(line)
+            elif current:
+                level_maps.append(current)
+                current = []
+    if current:
+        level_maps.append(current)
+    return level_maps
+
+
+def build_level_pack(level_maps):
+    # -> (manifest, blob); одинаковые раскладки попадают в blob один раз
+    blob = bytearray()
+    layouts, offsets, order = [], {}, []
+    for level_map in level_maps:
+        data = compile_layout(level_map).pack()
+        if data not in offsets:
+            offsets[data] = len(layouts)
+            layouts.append({"offset": len(blob), "size": len(data)})
+            blob += data
+        order.append(offsets[data])
+    return {"version": 1, "tile_size": TILE_SIZE, "layouts": layouts, "levels": order}, bytes(blob)
+
+
+def write_level_pack(directory, level_maps):
+    manifest, blob = build_level_pack(level_maps)
+    with open(os.path.join(directory, "layouts.bin"), 'wb') as f:
+        f.write(blob)
+    with open(os.path.join(directory, "manifest.json"), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+class LevelPack:
+    def __init__(self, manifest, blob_path=None, blob=None):
+        self.layouts = manifest["layouts"]
+        self.levels = manifest["levels"]
+        self.blob_path = blob_path
+        self.blob = blob
+        self.cache = OrderedDict()
+
+    @classmethod
+    def open(cls, directory):
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            return cls(manifest, blob_path=os.path.join(directory, "layouts.bin"))
+        # Пакет ещё не собран - собираем в памяти из исходника
+        manifest, blob = build_level_pack(read_level_source(os.path.join(directory, "source.txt")))
+        return cls(manifest, blob=blob)
+
+    def __len__(self):
+        return len(self.levels)
+
+    def layout(self, level_index):
+        layout_index = self.levels[level_index]
+        layout = self.cache.get(layout_index)
+        if layout is None:
+            entry = self.layouts[layout_index]
+            if self.blob is not None:
+                data = self.blob[entry["offset"]:entry["offset"] + entry["size"]]
+            else:
+                with open(self.blob_path, 'rb') as f:
+                    f.seek(entry["offset"])
+                    data = f.read(entry["size"])
+            layout = CompiledLayout.unpack(data)
+            self.cache[layout_index] = layout
+            if len(self.cache) > LAYOUT_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(layout_index)
+        return layout
+
+
+level_pack = None
+LEVEL_DIR = "levels"
+
+
+def get_level_pack():
+    global level_pack
+    if level_pack is None:
+        level_pack = LevelPack.open(LEVEL_DIR)
+    return level_pack
+
+
 # --- Функции ---
-def load_level(level_map):
-    walls = pygame.sprite.Group()
+def load_level(layout, rng=random):
+    if not isinstance(layout, CompiledLayout):
+        layout = compile_layout(layout)
     enemies = pygame.sprite.Group()
     health_packs = pygame.sprite.Group()
     bonus = pygame.sprite.Group()
     key = None
     door = None
-
-    for row_idx, row in enumerate(level_map):
-        for col_idx, tile in enumerate(row):
-            x, y = col_idx * TILE_SIZE, row_idx * TILE_SIZE
-            if tile == "W":
-                walls.add(Wall(x, y, TILE_SIZE, TILE_SIZE))
-            elif tile == "A":  # Стена, усиливающая звук
-                walls.add(Wall(x, y, TILE_SIZE, TILE_SIZE, amplification=True))
-            elif tile == "P":  # Стена, поглощающая звук
-                walls.add(Wall(x, y, TILE_SIZE, TILE_SIZE, absorption=True))
-            elif tile == "E":
-                enemies.add(Enemy(x, y, health=1))
-            elif tile == "B":
-                enemies.add(Enemy(x, y, health=3))
-            elif tile == "K":
-                key = Key(x, y)
-            elif tile == "D":
-                door = Door(x, y)
-            elif tile == "H":
-                health_packs.add(HealthPack(x, y))
-            elif tile == "X":
-                bonus.add(Bonus(x, y))
-
-    return walls, enemies, health_packs, key, door, bonus
-
-
-def draw_ui(player):
-    font = pygame.font.Font(None, 36)
-    health_text = font.render(f"Здоровье: {player.health}", True, WHITE)
-    score_text = font.render(f"Очки: {player.score}", True, WHITE)
-    waves_text = font.render(f"Волны: {max_waves - current_waves}/{max_waves}", True, WHITE)
-    screen.blit(health_text, (10, 10))
-    screen.blit(score_text, (10, 50))
-    screen.blit(waves_text, (10, 90))
+    # Сетка стен уже разобрана при компиляции, клетки идут по строкам; стены
+    # не спрайты, а коды в чанках сетки
+    wall_grid = TileGrid.from_cells(layout.cols, layout.rows, layout.cells)
+
+    for tile, col_idx, row_idx in layout.spawns:
+        x, y = col_idx * TILE_SIZE, row_idx * TILE_SIZE
+        if tile == "E":
+            enemies.add(Enemy(x, y, health=1, rng=rng))
+        elif tile == "B":
+            enemies.add(Enemy(x, y, health=3, rng=rng))
+        elif tile == "K":
+            key = Key(x, y)
+        elif tile == "D":
+            door = Door(x, y)
+        elif tile == "H":
+            health_packs.add(HealthPack(x, y))
+        elif tile == "X":
+            bonus.add(Bonus(x, y))
+
+    return wall_grid, enemies, health_packs, key, door, bonus
+
+
+def render_static_layer(wall_grid, key, door):
+    # Неподвижная часть уровня без прокрутки рисуется один раз в фоновую поверхность
+    background = pygame.Surface((WIDTH, HEIGHT)).convert()
+    background.fill(BLACK)
+    wall_grid.draw(background, SCREEN_RECT)
+    if key is not None:
+        background.blit(key.image, key.rect)
+    if door is not None:
+        background.blit(door.image, door.rect)
+    return background
+
+
+# --- Кэш шрифтов и надписей ---
+TEXT_CACHE_SIZE = 256
+fonts = {}
+text_cache = OrderedDict()
+
+
+def get_font(size):
+    font = fonts.get(size)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = pygame.font.Font(None, size)
+        fonts[size] = font
+    return font
+
+
+def render_text(text, size, color):
+    # Надпись рендерится один раз; давно не использованные вытесняются (LRU)
+    key = (text, size, color)
+    surface = text_cache.get(key)
+    if surface is None:
+        surface = get_font(size).render(text, True, color)
+        text_cache[key] = surface
+        if len(text_cache) > TEXT_CACHE_SIZE:
+            text_cache.popitem(last=False)
+    else:
+        text_cache.move_to_end(key)
+    return surface
+
+
+def draw_ui(game):
+    health_text = render_text(f"Здоровье: {game.player.health}", 36, WHITE)
+    score_text = render_text(f"Очки: {game.player.score}", 36, WHITE)
+    waves_text = render_text(f"Волны: {game.max_waves - game.current_waves}/{game.max_waves}", 36, WHITE)
+    renderer.blit(health_text, (10, 10))
+    renderer.blit(score_text, (10, 50))
+    renderer.blit(waves_text, (10, 90))
+
+
+# --- Меню ---
+MENU_HOVER = YELLOW
+MENU_KEYS = {pygame.K_UP: -1, pygame.K_DOWN: 1}
+menus = {}
+
+
+class Menu:
+    # Экран меню: заголовок и пункты рисуются один раз в фон, дальше цикл спит
+    # в pygame.event.wait и перерисовывает только пункты, у которых сменилась
+    # подсветка. items - пары (текст, значение), значение None - пункт неактивен
+    def __init__(self, title, items, spacing=50, cancel=None):
+        self.cancel = cancel  # что вернуть по Escape
+        self.background = pygame.Surface((WIDTH, HEIGHT)).convert()
+        self.background.fill(BLACK)
+        title_image = render_text(title, 74, WHITE)
+        self.background.blit(title_image, title_image.get_rect(midtop=(WIDTH // 2, HEIGHT // 4)))
+        self.items = []
+        for i, (label, value) in enumerate(items):
+            image = render_text(label, 36, WHITE if value is not None else GRAY)
+            hover = render_text(label, 36, MENU_HOVER) if value is not None else image
+            rect = image.get_rect(midtop=(WIDTH // 2, HEIGHT // 2 + i * spacing))
+            self.background.blit(image, rect)
+            self.items.append((rect, value, image, hover))
+        self.active = [i for i, item in enumerate(self.items) if item[1] is not None]
+        self.hovered = None
+
+    def item_at(self, pos):
+        for i in self.active:
+            if self.items[i][0].collidepoint(pos):
+                return i
+        return None
+
+    def draw(self):
+        renderer.blit(self.background, (0, 0))
+        if self.hovered is not None:
+            rect, _, _, hover = self.items[self.hovered]
+            renderer.blit(hover, rect)
+        renderer.present()
+
+    def highlight(self, index):
+        if index == self.hovered:
+            return
+        if not renderer.incremental:
+            self.hovered = index
+            self.draw()
+            return
+        dirty = []
+        for i in (self.hovered, index):
+            if i is not None:
+                rect, _, image, hover = self.items[i]
+                renderer.blit(self.background, rect, rect)
+                renderer.blit(hover if i == index else image, rect)
+                dirty.append(rect)
+        self.hovered = index
+        renderer.present(dirty)
+
+    def step(self, direction):
+        if not self.active:
+            return
+        if self.hovered is None:
+            index = self.active[0] if direction > 0 else self.active[-1]
+        else:
+            index = self.active[(self.active.index(self.hovered) + direction) % len(self.active)]
+        self.highlight(index)
+
+    def run(self):
+        self.hovered = None
+        self.draw()
+        self.highlight(self.item_at(pygame.mouse.get_pos()))
+        while True:
+            event = pygame.event.wait()
+            if event.type in QUIT_EVENTS:
+                pygame.quit()
+                sys.exit()
+            if event.type == pygame.MOUSEMOTION:
+                self.highlight(self.item_at(event.pos))
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                index = self.item_at(event.pos)
+                if index is not None:
+                    return self.items[index][1]
+            elif event.type == pygame.KEYDOWN:
+                if event.key in MENU_KEYS:
+                    self.step(MENU_KEYS[event.key])
+                elif event.key == pygame.K_RETURN and self.hovered is not None:
+                    return self.items[self.hovered][1]
+                elif event.key == pygame.K_ESCAPE:
+                    return self.cancel
+
+
+def get_menu(key, title, items, **options):
+    # Меню собирается один раз на ключ; ключ меняется, когда меняются пункты
+    menu = menus.get(key)
+    if menu is None:
+        menu = menus[key] = Menu(title, items, **options)
+    return menu
 
 
 def level_select_menu():
     max_level = load_progress()
-    while True:
-        screen.fill(BLACK)
-        font = pygame.font.Font(None, 74)
-        text = font.render("Выбор уровня", True, WHITE)
-        screen.blit(text, (WIDTH // 2 - text.get_width() // 2, HEIGHT // 4))
-
-        font = pygame.font.Font(None, 36)
-        level_texts = []
-        for i in range(len(levels)):
-            if i <= max_level:
-                level_text = font.render(f"Уровень {i + 1}", True, WHITE)
-            else:
-                level_text = font.render(f"Уровень {i + 1} (Заблокировано)", True, GRAY)
-            screen.blit(level_text, (WIDTH // 2 - level_text.get_width() // 2, HEIGHT // 2 + i * 40))
-            level_texts.append(level_text)
+    level_count = len(get_level_pack())
+    items = [(f"Уровень {i + 1}", i) if i <= max_level else (f"Уровень {i + 1} (Заблокировано)", None)
+             for i in range(level_count)]
+    return get_menu(("levels", max_level, level_count), "Выбор уровня", items, spacing=40).run()
 
-        pygame.display.flip()
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                for i in range(len(level_texts)):
-                    level_text_rect = level_texts[i].get_rect(topleft=(WIDTH // 2 - level_texts[i].get_width() // 2, HEIGHT // 2 + i * 40))
-                    if level_text_rect.collidepoint(event.pos) and i <= max_level:
-                        return i
 
 def main_menu():
+    items = [("Играть", "play"), ("Выбор уровня", "levels"), ("Выход", "quit")]
     while True:
-        screen.fill(BLACK)
-        font = pygame.font.Font(None, 74)
-        text = font.render("Эхо-рыцарь", True, WHITE)
-        screen.blit(text, (WIDTH // 2 - text.get_width() // 2, HEIGHT // 4))
-
-        font = pygame.font.Font(None, 36)
-        play_text = font.render("Играть", True, WHITE)
-        screen.blit(play_text, (WIDTH // 2 - play_text.get_width() // 2, HEIGHT // 2))
-        level_select_text = font.render("Выбор уровня", True, WHITE)
-        screen.blit(level_select_text, (WIDTH // 2 - level_select_text.get_width() // 2, HEIGHT // 2 + 50))
-        quit_text = font.render("Выход", True, WHITE)
-        screen.blit(quit_text, (WIDTH // 2 - quit_text.get_width() // 2, HEIGHT // 2 + 100))
-
-        pygame.display.flip()
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if play_text.get_rect(topleft=(WIDTH // 2 - play_text.get_width() // 2, HEIGHT // 2)).collidepoint(event.pos):
-                    return
-                if level_select_text.get_rect(topleft=(WIDTH // 2 - level_select_text.get_width() // 2, HEIGHT // 2 + 50)).collidepoint(event.pos):
-                    selected_level = level_select_menu()
-                    if selected_level is not None:
-                        global current_level
-                        current_level = selected_level
-                        restart_level()
-                        return
-                if quit_text.get_rect(topleft=(WIDTH // 2 - quit_text.get_width() // 2, HEIGHT // 2 + 100)).collidepoint(event.pos):
-                    pygame.quit()
-                    sys.exit()
+        choice = get_menu("main", "Эхо-рыцарь", items).run()
+        if choice == "play":
+            return
+        if choice == "levels":
+            selected_level = level_select_menu()
+            if selected_level is not None:
+                world.current_level = selected_level
+                world.restart_level()
+                return
+        if choice == "quit":
+            pygame.quit()
+            sys.exit()
+
 
 def pause_menu():
-    paused = True
-    while paused:
-        screen.fill(BLACK)
-        font = pygame.font.Font(None, 74)
-        text = font.render("Пауза", True, WHITE)
-        screen.blit(text, (WIDTH // 2 - text.get_width() // 2, HEIGHT // 4))
-
-        font = pygame.font.Font(None, 36)
-        resume_text = font.render("Продолжить", True, WHITE)
-        screen.blit(resume_text, (WIDTH // 2 - resume_text.get_width() // 2, HEIGHT // 2))
-        quit_text = font.render("Выход", True, WHITE)
-        screen.blit(quit_text, (WIDTH // 2 - quit_text.get_width() // 2, HEIGHT // 2 + 50))
-
-        pygame.display.flip()
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if resume_text.get_rect(topleft=(WIDTH // 2 - resume_text.get_width() // 2, HEIGHT // 2)).collidepoint(
-                        event.pos):
-                    paused = False
-                if quit_text.get_rect(topleft=(WIDTH // 2 - quit_text.get_width() // 2, HEIGHT // 2 + 50)).collidepoint(
-                        event.pos):
-                    pygame.quit()
-                    sys.exit()
-
-
-def restart_level():
-    global walls, enemies, health_packs, key, door, bonus, all_sprites, waves, bullets, current_waves
-    player.rect.topleft = (100, 100)
-    player.health = 100
-    current_waves = 0
-    walls, enemies, health_packs, key, door, bonus = load_level(levels[current_level])
-    all_sprites = pygame.sprite.Group(player, *walls, *enemies)
-    if key is not None:
-        all_sprites.add(key)
-    if door is not None:
-        all_sprites.add(door)
-    all_sprites.add(*health_packs, *bonus)
-    waves = pygame.sprite.Group()
-    bullets = pygame.sprite.Group()
-
-
-# --- Уровни ---
-levels = [
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H          K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  E   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H    E     K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  E   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H          K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  B   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H        A  K  W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  P   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H    E     K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  E   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H          K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  B   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H        A  K  W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  P   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H    E     K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  E   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H          K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  B   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H        A  K  W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  P   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H    E     K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  E   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H          K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  B   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H        A  K  W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  P   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H    E     K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  E   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H          K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  B   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H        A  K  W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  P   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H    E     K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  E   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H          K   W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  B   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-    [
-        "WWWWWWWWWWWWWWWWWWWW",
-        "W   H        A  K  W",
-        "W   W  W   W       W",
-        "W   W      W  W    W",
-        "W   W              W",
-        "W   W  P   W       W",
-        "W   W      W  W    W",
-        "W   W  W       D   W",
-        "W   W  W   E       W",
-        "WWWWWWWWWWWWWWWWWWWW",
-    ],
-]
-
-current_level = 0
-
-
-# --- Инициализация ---
-player = Player(100, 100)
-walls, enemies, health_packs, key, door, bonus = load_level(levels[current_level])
-
-all_sprites = pygame.sprite.Group(player, *walls, *enemies)
-if key is not None:
-    all_sprites.add(key)
-if door is not None:
-    all_sprites.add(door)
-all_sprites.add(*health_packs, *bonus)
-waves = pygame.sprite.Group()
-bullets = pygame.sprite.Group()
-
-# --- Вход в главное меню ---
-main_menu()
+    items = [("Продолжить", "resume"), ("Выход", "quit")]
+    if get_menu("pause", "Пауза", items, cancel="resume").run() == "quit":
+        pygame.quit()
+        sys.exit()
 
-# --- Игровой цикл ---
-running = True
-has_key = False
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_SPACE and current_waves < max_waves:
-                mouse_x, mouse_y = pygame.mouse.get_pos()
-                dx = mouse_x - player.rect.centerx
-                dy = mouse_y - player.rect.centery
-                magnitude = (dx ** 2 + dy ** 2) ** 0.5
-                wave = Wave(player.rect.centerx, player.rect.centery, dx / magnitude * 10, dy / magnitude * 10)
-                waves.add(wave)
-                all_sprites.add(wave)
-                current_waves += 1
-            if event.key == pygame.K_p:
-                pause_menu()
 
-    keys = pygame.key.get_pressed()
-    player.update(keys, walls)
-    waves.update(walls, enemies)
-    bullets.update(walls)
-    enemies.update(walls)
+# --- Профайлер кадра ---
+PROFILER_PHASES = ("timers", "player", "waves", "bullets", "projectiles", "enemies", "index", "pickups", "hits",
+                   "level", "draw", "ui", "present", "wait")
+PROFILER_WINDOW = 120  # кадров в скользящем окне
+PROFILER_REFRESH = 30  # раз во сколько кадров обновлять текст оверлея
+PROFILER_RECT = pygame.Rect(WIDTH - 260, 0, 260, 22 * 22)
 
-    # Проверка столкновений
-    for health_pack in health_packs:
-        if player.rect.colliderect(health_pack.rect):
-            player.health = min(player.health + 20, 100)
-            health_pack.kill()
 
-    for bullet in bullets:
-        if bullet.rect.colliderect(player.rect):
-            player.health -= 10
-            bullet.kill()
-            if player.health <= 0:
-                restart_level()
-
-    if pygame.sprite.spritecollideany(player, enemies):
-        player.health -= 1
-        if player.health <= 0:
-            restart_level()
-
-    # Проверка столкновений
-    if key is not None and player.rect.colliderect(key.rect):
-        has_key = True
-        key.kill()
-
-    if has_key and door is not None and player.rect.colliderect(door.rect):
-        current_level += 1
-        if current_level < len(levels):
-            player.rect.topleft = (100, 100)  # Сброс позиции игрока
-            current_waves = 0  # Сброс количества волн
-            walls, enemies, health_packs, key, door, bonus = load_level(levels[current_level])
-            all_sprites = pygame.sprite.Group(player, *walls, *enemies)
-            if key is not None:
-                all_sprites.add(key)
-            if door is not None:
-                all_sprites.add(door)
-            all_sprites.add(*health_packs, *bonus)
-            waves = pygame.sprite.Group()
-            bullets = pygame.sprite.Group()
-            has_key = False
-            save_progress(current_level)
+def _skip(*args):
+    pass
+
+
+class FrameProfiler:
+    # Время каждой фазы кадра: mark(name) засчитывает фазе время с прошлой
+    # отметки. Пока нет ни оверлея, ни CSV, методы подменены пустой функцией
+    def __init__(self):
+        self.overlay = False
+        self.csv_file = None
+        self.csv_writer = None
+        self.frame_index = 0
+        self.history = {phase: deque(maxlen=PROFILER_WINDOW) for phase in PROFILER_PHASES}
+        self.totals = deque(maxlen=PROFILER_WINDOW)
+        self.current = dict.fromkeys(PROFILER_PHASES, 0.0)
+        self.lines = []
+        self.frame_start = self.last_mark = time.perf_counter()
+        self._switch()
+
+    def _switch(self):
+        if self.overlay or self.csv_writer is not None:
+            for name in ("begin_frame", "mark", "end_frame"):
+                self.__dict__.pop(name, None)
+        else:
+            self.begin_frame = self.mark = self.end_frame = _skip
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self._switch()
+
+    def open_csv(self, path):
+        self.csv_file = open(path, 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(("frame",) + PROFILER_PHASES + ("total",))
+        atexit.register(self.close)  # меню выходят через sys.exit, мимо main
+        self._switch()
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = self.csv_writer = None
+            self._switch()
+
+    def begin_frame(self):
+        self.frame_start = self.last_mark = time.perf_counter()
+        for phase in PROFILER_PHASES:
+            self.current[phase] = 0.0
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[phase] += (now - self.last_mark) * 1000
+        self.last_mark = now
+
+    def end_frame(self):
+        total = (time.perf_counter() - self.frame_start) * 1000
+        self.totals.append(total)
+        for phase in PROFILER_PHASES:
+            self.history[phase].append(self.current[phase])
+        if self.csv_writer is not None:
+            self.csv_writer.writerow([self.frame_index] + [f"{self.current[phase]:.3f}" for phase in PROFILER_PHASES]
+                                     + [f"{total:.3f}"])
+        self.frame_index += 1
+
+    def refresh_lines(self):
+        totals = sorted(self.totals)
+        if not totals:
+            return
+        p95 = totals[min(int(len(totals) * 0.95), len(totals) - 1)]
+        p99 = totals[min(int(len(totals) * 0.99), len(totals) - 1)]
+        self.lines = [f"кадр {sum(totals) / len(totals):.2f} мс  p95 {p95:.2f}  p99 {p99:.2f}"]
+        for phase in PROFILER_PHASES:
+            samples = self.history[phase]
+            self.lines.append(f"{phase:12} {sum(samples) / len(samples):6.2f} мс")
+        counts = world.sprite_counts()
+        self.lines.extend(f"{name:12} {count:6}" for name, count in counts.items())
+
+    def draw_overlay(self, target):
+        if self.frame_index % PROFILER_REFRESH == 0 or not self.lines:
+            self.refresh_lines()
+        target.fill(BLACK, PROFILER_RECT)
+        for i, line in enumerate(self.lines):
+            target.blit(render_text(line, 22, YELLOW), (PROFILER_RECT.x + 8, PROFILER_RECT.y + 6 + i * 20))
+
+
+profiler = FrameProfiler()
+
+
+# --- Память ---
+ALLOC_SAMPLE_INTERVAL = 60  # раз во сколько кадров снимок tracemalloc для мест, где память копится
+ALLOC_TOP_SITES = 25
+
+
+def gc_safe_point():
+    # Собираем весь накопленный мусор сразу, пока кадр не идёт, а выжившее
+    # (карта, спрайты уровня, изображения) замораживаем: сборки старшего
+    # поколения посреди кадра больше не обходят эти объекты. Перед сборкой
+    # размораживаем, иначе прошлый уровень остался бы в памяти навсегда.
+    # Без окна кадров нет - и беречь нечего
+    if not GC_SAFE_POINTS or HEADLESS:
+        return
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
+
+def source_sections(path):
+    # Номера строк заголовков "# --- Раздел ---" файла - подсистемы для отчёта
+    starts, names = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if line.startswith("# --- ") and line.rstrip().endswith(" ---"):
+                starts.append(number)
+                names.append(line.strip()[6:-4])
+    return starts, names
+
+
+class AllocationTracker:
+    # Память по кадрам через tracemalloc. Отдельные выделения tracemalloc не
+    # считает, поэтому в CSV на кадр: net_blocks - на сколько изменилось число
+    # живых блоков, live_kib - занято в конце кадра, transient_kib - сколько
+    # сверх этого было выделено и освобождено внутри кадра (пик минус больший из
+    # краёв; это и есть мусор кадра), и время сборок по поколениям. Раз в
+    # ALLOC_SAMPLE_INTERVAL кадров - снимок: места, где память копится между
+    # снимками, по подсистемам (разделам ppc.py). Пока отслеживание не
+    # включено, end_frame - пустая функция, как у FrameProfiler
+    def __init__(self):
+        self.csv_file = None
+        self.end_frame = _skip
+
+    def start(self, path):
+        tracemalloc.start()
+        self.path = path
+        self.csv_file = open(path, 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(("frame", "net_blocks", "live_kib", "transient_kib", "gc0_ms", "gc1_ms", "gc2_ms"))
+        self.frame_index = 0
+        self.blocks = sys.getallocatedblocks()
+        self.live = tracemalloc.get_traced_memory()[0]
+        self.gc_ms = [0.0, 0.0, 0.0]
+        self.gc_start = 0.0
+        self.sections = source_sections(__file__)
+        # Учёт самого трекера и окно профайлера - это измерение, а не игра
+        self.skipped = {self.subsystem(__file__, AllocationTracker.sample.__code__.co_firstlineno),
+                        self.subsystem(__file__, FrameProfiler.end_frame.__code__.co_firstlineno)}
+        self.sites = {}  # (файл, строка) -> [прирост KiB, прирост блоков]
+        self.snapshot = tracemalloc.take_snapshot()
+        gc.callbacks.append(self.on_gc)
+        atexit.register(self.close)  # меню выходят через sys.exit, мимо main
+        self.__dict__.pop("end_frame", None)
+
+    def on_gc(self, phase, info):
+        if phase == "start":
+            self.gc_start = time.perf_counter()
+        else:
+            self.gc_ms[info["generation"]] += (time.perf_counter() - self.gc_start) * 1000
+
+    def end_frame(self):
+        blocks = sys.getallocatedblocks()
+        live, peak = tracemalloc.get_traced_memory()
+        self.csv_writer.writerow([self.frame_index, blocks - self.blocks, f"{live / 1024:.1f}",
+                                  f"{(peak - max(live, self.live)) / 1024:.1f}"]
+                                 + [f"{ms:.3f}" for ms in self.gc_ms])
+        self.gc_ms = [0.0, 0.0, 0.0]
+        self.frame_index += 1
+        if self.frame_index % ALLOC_SAMPLE_INTERVAL == 0:
+            self.sample()
+        # Сам учёт не должен попадать в следующий кадр
+        self.blocks = sys.getallocatedblocks()
+        self.live = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def sample(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        for stat in snapshot.compare_to(self.snapshot, "lineno"):
+            frame = stat.traceback[0]
+            if stat.size_diff > 0 and self.subsystem(frame.filename, frame.lineno) not in self.skipped:
+                site = self.sites.setdefault((frame.filename, frame.lineno), [0.0, 0])
+                site[0] += stat.size_diff / 1024
+                site[1] += stat.count_diff
+        self.snapshot = snapshot
+
+    def subsystem(self, filename, lineno):
+        if os.path.abspath(filename) != os.path.abspath(__file__):
+            return os.path.basename(filename)
+        starts, names = self.sections
+        index = bisect.bisect_right(starts, lineno) - 1
+        return names[index] if index >= 0 else "ppc.py"
+
+    def close(self):
+        if self.csv_file is None:
+            return
+        gc.callbacks.remove(self.on_gc)
+        self.csv_file.close()
+        self.csv_file = None
+        self.end_frame = _skip
+        tracemalloc.stop()
+        totals = {}
+        for (filename, lineno), (kib, count) in self.sites.items():
+            total = totals.setdefault(self.subsystem(filename, lineno), [0.0, 0])
+            total[0] += kib
+            total[1] += count
+        top = sorted(self.sites.items(), key=lambda item: item[1][0], reverse=True)[:ALLOC_TOP_SITES]
+        with open(os.path.splitext(self.path)[0] + "-sites.txt", 'w', encoding='utf-8') as f:
+            f.write(f"кадров {self.frame_index}; память, оставшаяся занятой между снимками раз в "
+                    f"{ALLOC_SAMPLE_INTERVAL} кадров (мусор внутри кадра - transient_kib в CSV)\n\n")
+            f.write("По подсистемам:\n")
+            for name, (kib, count) in sorted(totals.items(), key=lambda item: item[1][0], reverse=True):
+                f.write(f"{name:40} {kib:10.1f} KiB {count:8} блоков\n")
+            f.write("\nМеста, где копится память:\n")
+            for (filename, lineno), (kib, count) in top:
+                f.write(f"{os.path.basename(filename) + ':' + str(lineno):40} {kib:10.1f} KiB {count:8} блоков  "
+                        f"{self.subsystem(filename, lineno)}\n")
+
+
+allocations = AllocationTracker()
+
+
+# --- Игровой мир ---
+class LevelSnapshot:
+    # Начальное состояние уровня сразу после load_level. Стены, спрайты и фон
+    # переиспользуются как есть, а изменяемое - позиции, скорости и здоровье
+    # врагов, набор аптечек и бонусов, ключ и состояние rng - запомнено, и
+    # World.restore_level возвращает его без разбора карты и создания спрайтов
+    def __init__(self, level, wall_grid, enemies, health_packs, key, door, bonus, rng_state):
+        self.level = level  # индекс в пакете уровней; None - карта передана напрямую
+        self.wall_grid = wall_grid
+        self.enemies = [(enemy, enemy.rect.topleft, enemy.speed, enemy.health) for enemy in enemies]
+        self.health_packs = health_packs.sprites()
+        self.bonus = bonus.sprites()
+        self.key = key
+        self.door = door
+        self.rng_state = rng_state
+        self.background = None  # фон карты без прокрутки, рисуется при первом восстановлении
+
+
+class World:
+    # Всё состояние одной игры: игрок, группы спрайтов текущего уровня,
+    # счётчики, игровое время и свой генератор случайных чисел, чтобы миры с
+    # одним seed вели себя одинаково. Активный мир лежит в модульной переменной world
+    def __init__(self, level_index=0, seed=None):
+        init_display()
+        # Любой целый seed приводится к 64 битам заголовка записи, чтобы сыгранное
+        # с ним можно было и записать; отрицательные и большие тоже работают
+        self.seed = (seed if seed is not None else random.randrange(2 ** 32)) % 2 ** 64
+        self.rng = random.Random()
+        self.player = Player(100, 100)
+        self.current_level = level_index
+        self.max_waves = MAX_WAVES
+        self.current_waves = 0
+        self.has_key = False
+        self.running = True
+        self.won = False  # running сбрасывает и выход из игры, а это только победа
+        # Игровое время в мс: в обычном режиме растёт на время кадра, без окна -
+        # на фиксированный шаг, поэтому логика не зависит от реальных часов
+        self.clock = GameClock()
+        self.snapshot = None
+        self.gc_pending = False  # уровень сменился - собрать мусор после вывода кадра
+        self.waves = pygame.sprite.Group()
+        self.bullets = pygame.sprite.Group()
+        self.broadphase = SpatialHash()
+        self.pickups = SpatialHash(CHUNK_SIZE)  # аптечки и бонусы не двигаются - индекс на весь уровень
+        self.projectiles = ProjectileSystem() if NUMPY_PROJECTILES and load_numpy() else None
+        self.start_level(level_index)
+
+    def advance_time(self, dt):
+        self.clock.advance(dt)
+
+    def setup_level(self, level_map, level=None):
+        # Уровень с нуля: разбор карты, спрайты и снимок начального состояния
+        state = load_level(level_map, self.rng)
+        self.snapshot = LevelSnapshot(level, *state, self.rng.getstate())
+        self.restore_level()
+
+    def restore_level(self):
+        # Уровень в начальное состояние из снимка. Всё, что осталось от прошлого
+        # захода (и от прошлого уровня), убираем из групп: снаряды вернутся в пулы
+        snapshot = self.snapshot
+        for sprite in (*self.bullets, *self.waves, *snapshot.health_packs, *snapshot.bonus):
+            sprite.kill()
+        for enemy, topleft, speed, health in snapshot.enemies:
+            enemy.kill()
+            enemy.restore(topleft, speed, health)
+        self.player.rect.topleft = (100, 100)
+        self.current_waves = 0
+        self.has_key = False
+        self.clock.clear()  # таймеры прошлого захода больше ни к чему
+        self.previous = {}
+        self.rng.setstate(snapshot.rng_state)
+        self.wall_grid = snapshot.wall_grid
+        self.enemies = pygame.sprite.Group(*(entry[0] for entry in snapshot.enemies))
+        self.health_packs = pygame.sprite.Group(*snapshot.health_packs)
+        self.bonus = pygame.sprite.Group(*snapshot.bonus)
+        self.key = snapshot.key
+        self.door = snapshot.door
+        self.camera = Camera(self.wall_grid.width, self.wall_grid.height)
+        self.camera.follow(self.player.rect)
+        self.area = self.camera.active_area()
+        self.pickups.rebuild(health_packs=self.health_packs, bonus=self.bonus)
+        # Враги вне активной области спят в корзинах по чанкам и не обновляются;
+        # просыпаются они в порядке расстановки, как будто спали все сразу
+        self.enemy_order = {enemy: order for order, enemy in enumerate(self.enemies)}
+        self.sleeping = {}
+        for enemy in self.enemies:
+            self.sleeping.setdefault(self.chunk_of(enemy.rect), []).append(enemy)
+        self.awake = pygame.sprite.Group()
+        self.wake_enemies()
+        self.flow = FlowField(self.wall_grid)
+        self.flow.update(self.player.rect)
+        # Фон запекается только для карты без прокрутки
+        if not self.camera.scrolls and snapshot.background is None:
+            snapshot.background = render_static_layer(self.wall_grid, self.key, self.door)
+        self.background = snapshot.background
+        self.all_sprites = self.make_all_sprites()
+        if self.projectiles is not None:
+            self.projectiles.reset(self.wall_grid)
+        self.index_dynamic_sprites()
+        # Смерть и дверь случаются посреди шага, поэтому здесь только отмечаем
+        self.gc_pending = True
+
+    def start_level(self, index):
+        # У каждого уровня свой поток случайностей из seed мира: повторный заход
+        # на уровень (после смерти или из меню) ведёт себя так же, как первый,
+        # и берётся из снимка, если уровень тот же
+        self.current_level = index
+        if self.snapshot is not None and self.snapshot.level == index:
+            self.restore_level()
+            return
+        self.rng.seed(f"{self.seed}:{index}")
+        self.setup_level(get_level_pack().layout(index), index)
+
+    def restart_level(self):
+        self.player.health = 100
+        if self.snapshot.level is None:
+            self.restore_level()  # карта передана напрямую (стресс-сцены) - повторяем её же
+        else:
+            self.start_level(self.current_level)
+
+    def make_all_sprites(self):
+        # В группе только то, что двигается или может исчезнуть; стены, ключ и дверь уже в фоне.
+        # Если кадр рисует render_full, группа лишь собирает снаряды
+        self.player.kill()  # из группы прошлого захода
+        if self.camera.scrolls or not (DIRTY_RENDERING and renderer.incremental):
+            return pygame.sprite.LayeredDirty(self.player)
+        sprites = pygame.sprite.LayeredDirty(self.player, *self.enemies, *self.health_packs, *self.bonus)
+        sprites.clear(screen, self.background)
+        sprites.repaint_rect(SCREEN_RECT)
+        return sprites
+
+    def chunk_of(self, rect):
+        return rect.centerx // CHUNK_SIZE, rect.centery // CHUNK_SIZE
+
+    def wake_enemies(self):
+        # Активная область в чанках: враги вне её засыпают, спящие внутри просыпаются
+        area = self.area
+        columns = range(area.left // CHUNK_SIZE, (area.right - 1) // CHUNK_SIZE + 1)
+        rows = range(area.top // CHUNK_SIZE, (area.bottom - 1) // CHUNK_SIZE + 1)
+        for enemy in self.awake.sprites():
+            cx, cy = self.chunk_of(enemy.rect)
+            if cx not in columns or cy not in rows:
+                enemy.sleep()
+                self.awake.remove(enemy)
+                self.sleeping.setdefault((cx, cy), []).append(enemy)
+        woken = []
+        for cy in rows:
+            for cx in columns:
+                woken += self.sleeping.pop((cx, cy), ())
+        if woken:
+            woken.sort(key=self.enemy_order.__getitem__)
+            for enemy in woken:
+                enemy.wake(self.clock)
+            self.awake.add(*woken)
+
+    def index_dynamic_sprites(self):
+        self.broadphase.rebuild(enemies=self.awake, bullets=self.bullets)
+
+    def digest(self):
+        # Контрольная сумма состояния для сверки повторов: игрок, счётчики и
+        # позиции всех врагов и снарядов (снаряды отсортированы, чтобы сумма не
+        # зависела от того, какой движок снарядов включён)
+        player = self.player
+        values = [player.rect.x, player.rect.y, player.health, player.score, self.current_level,
+                  self.current_waves, self.has_key, self.clock.now()]
+        for enemy in self.enemies:
+            values += (enemy.rect.x, enemy.rect.y, enemy.health)
+        if self.projectiles is not None:
+            n = self.projectiles.count
+            shots = zip(self.projectiles.x[:n].tolist(), self.projectiles.y[:n].tolist())
         else:
-            print("Вы победили!")
-            running = False
+            shots = ((sprite.rect.x, sprite.rect.y) for group in (self.bullets, self.waves) for sprite in group)
+        for x, y in sorted(shots):
+            values += (x, y)
+        return zlib.crc32(struct.pack(f"<{len(values)}q", *values))
+
+    def sprite_counts(self):
+        counts = {"all_sprites": len(self.all_sprites), "enemies": len(self.enemies), "waves": len(self.waves),
+                  "awake": len(self.awake), "bullets": len(self.bullets), "health_packs": len(self.health_packs),
+                  "bonus": len(self.bonus)}
+        if self.projectiles is not None:
+            counts["projectiles"] = self.projectiles.count
+        return counts
+
+    def spawn_bullet(self, x, y, dx, dy):
+        if self.projectiles is not None:
+            self.projectiles.spawn(PROJECTILE_BULLET, x, y, dx, dy)
+        else:
+            bullet = bullet_pool.acquire(x, y, dx, dy, self.clock)
+            self.all_sprites.add(bullet)
+            self.bullets.add(bullet)
 
-    # Проверка столкновений с бонусами
-    for bonus_item in bonus:
-        if player.rect.colliderect(bonus_item.rect):
+    def spawn_wave(self, x, y, dx, dy):
+        if self.projectiles is not None:
+            self.projectiles.spawn(PROJECTILE_WAVE, x, y, dx, dy)
+        else:
+            wave = wave_pool.acquire(x, y, dx, dy, self.clock)
+            self.waves.add(wave)
+            self.all_sprites.add(wave)
+
+    def fire_wave(self, target):
+        player = self.player
+        if self.current_waves < self.max_waves:
+            mouse_x, mouse_y = target
+            dx = mouse_x - player.rect.centerx
+            dy = mouse_y - player.rect.centery
+            magnitude = (dx ** 2 + dy ** 2) ** 0.5
+            self.spawn_wave(player.rect.centerx, player.rect.centery, dx / magnitude * 10, dy / magnitude * 10)
+            self.current_waves += 1
+
+    def update_sprites(self, keys, fire_targets=()):
+        self.clock.run_due()
+        profiler.mark("timers")
+        for target in fire_targets:
+            self.fire_wave(target)
+
+        self.player.update(keys)
+        self.camera.follow(self.player.rect)
+        self.area = self.camera.active_area()
+        profiler.mark("player")
+        self.waves.update(self.wall_grid, self.broadphase, self.area)
+        profiler.mark("waves")
+        self.bullets.update(self.wall_grid, self.area)
+        profiler.mark("bullets")
+        if self.projectiles is not None:
+            self.projectiles.step(self.broadphase, self.area)
+            profiler.mark("projectiles")
+        self.wake_enemies()
+        self.flow.update(self.player.rect)
+        self.awake.update(self.wall_grid, self.flow)
+        profiler.mark("enemies")
+
+    def resolve_collisions(self):
+        player, broadphase = self.player, self.broadphase
+        # Враги до следующего вызова enemies.update не двигаются, поэтому этот же
+        # индекс используют и волны в следующем кадре
+        self.index_dynamic_sprites()
+        profiler.mark("index")
+
+        # Проверка столкновений
+        for health_pack in self.pickups.query("health_packs", player.rect):
+            player.health = min(player.health + 20, 100)
+            health_pack.kill()
+        profiler.mark("pickups")
+
+        for bullet in broadphase.query("bullets", player.rect):
+            if bullet.rect.colliderect(player.rect):
+                player.health -= 10
+                bullet.kill()
+                if player.health <= 0:
+                    self.restart_level()
+
+        if self.projectiles is not None:
+            for _ in range(self.projectiles.take_hits(player.rect)):
+                player.health -= 10
+                if player.health <= 0:
+                    self.restart_level()
+                    break
+
+        if broadphase.query("enemies", player.rect):
+            player.health -= 1
+            if player.health <= 0:
+                self.restart_level()
+        profiler.mark("hits")
+
+        # Проверка столкновений
+        if self.key is not None and player.rect.colliderect(self.key.rect):
+            self.has_key = True
+            self.key.kill()
+            self.key = None
+            if self.background is not None:
+                # Ключ был запечён в фон - перерисовываем фон без него
+                self.background = render_static_layer(self.wall_grid, self.key, self.door)
+                self.all_sprites.clear(screen, self.background)
+                self.all_sprites.repaint_rect(SCREEN_RECT)
+
+        if self.has_key and self.door is not None and player.rect.colliderect(self.door.rect):
+            self.current_level += 1
+            if self.current_level < len(get_level_pack()):
+                self.start_level(self.current_level)  # сброс позиции игрока, волн и ключа
+                if not HEADLESS:
+                    save_progress(self.current_level)
+            else:
+                if not HEADLESS:
+                    print("Вы победили!")
+                self.won = True
+                self.running = False
+        profiler.mark("level")
+
+        # Проверка столкновений с бонусами
+        for bonus_item in self.pickups.query("bonus", player.rect):
             player.score += 50
             bonus_item.kill()
+        profiler.mark("pickups")
+
+    def game_step(self, keys, fire_targets=()):
+        # Один тик игровой логики без отрисовки. keys - зажатые клавиши (как у
+        # pygame.key.get_pressed), fire_targets - точки, куда за тик выпущены волны
+        self.update_sprites(keys, fire_targets)
+        self.resolve_collisions()
+        return self.running
+
+    def remember_positions(self):
+        # Положения движущихся спрайтов до шага симуляции - для render_frame(alpha)
+        previous = {sprite: sprite.rect.topleft for group in (self.awake, self.bullets, self.waves)
+                    for sprite in group}
+        previous[self.player] = self.player.rect.topleft
+        self.previous = previous
+        if self.projectiles is not None:
+            self.projectiles.remember()
+
+    def interpolate(self, alpha):
+        # Ставит спрайты на долю alpha пути от прошлого шага к текущему; возвращает,
+        # куда их вернуть после отрисовки. Скачки больше клетки (телепорт, пуля,
+        # взятая из пула заново) не сглаживаются
+        restore = []
+        for sprite, (x0, y0) in self.previous.items():
+            rect = sprite.rect
+            x1, y1 = rect.topleft
+            if (x0, y0) != (x1, y1) and abs(x1 - x0) + abs(y1 - y0) <= TILE_SIZE:
+                restore.append((rect, x1, y1))
+                rect.topleft = (round(x0 + (x1 - x0) * alpha), round(y0 + (y1 - y0) * alpha))
+        self.camera.follow(self.player.rect)
+        return restore
+
+    def render_frame(self, alpha=1.0):
+        # alpha - доля шага симуляции, прошедшая после последнего шага (1 - рисовать как есть)
+        restore = self.interpolate(alpha) if alpha < 1.0 else ()
+        if DIRTY_RENDERING and renderer.incremental and not self.camera.scrolls:
+            self.render_dirty(alpha)
+        else:
+            self.render_full(alpha)
+        for rect, x, y in restore:
+            rect.topleft = (x, y)
+        if restore:
+            self.camera.follow(self.player.rect)
+
+    def render_dirty(self, alpha):
+        # Карта без прокрутки на SurfaceRenderer: фон запечён, на экран выводятся
+        # только изменившиеся прямоугольники
+        all_sprites, projectiles = self.all_sprites, self.projectiles
+        all_sprites.repaint_rect(HUD_RECT)  # текст интерфейса меняется, под ним восстанавливаем фон
+        if profiler.overlay:
+            all_sprites.repaint_rect(PROFILER_RECT)
+        if projectiles is not None:
+            # Снаряды движка рисуются поверх группы - стираем их прошлые позиции
+            if len(projectiles.drawn_rects) > PROJECTILE_DIRTY_LIMIT:
+                all_sprites.repaint_rect(SCREEN_RECT)
+            else:
+                for rect in projectiles.drawn_rects:
+                    all_sprites.repaint_rect(rect)
+        dirty_rects = all_sprites.draw(screen)
+        if projectiles is not None:
+            dirty_rects += projectiles.draw(screen, alpha=alpha)
+        profiler.mark("draw")
+        draw_ui(self)
+        if profiler.overlay:
+            profiler.draw_overlay(renderer)
+        profiler.mark("ui")
+        renderer.present(dirty_rects)
+        profiler.mark("present")
+
+    def render_full(self, alpha):
+        # Кадр целиком: при прокрутке, на бэкендах без сохранения кадра и без
+        # DIRTY_RENDERING. Рисуется только видимое: фон или чанки стен под
+        # окном и спрайты, попавшие в окно
+        view = self.camera.view
+        offset = (-view.x, -view.y)
+        if self.background is not None:
+            renderer.blit(self.background, (0, 0))  # ключ и дверь уже в фоне
+            visible = []
+        else:
+            renderer.fill(BLACK)
+            self.wall_grid.draw(renderer, view)
+            visible = [sprite for sprite in (self.key, self.door)
+                       if sprite is not None and view.colliderect(sprite.rect)]
+        visible += self.pickups.query("health_packs", view) + self.pickups.query("bonus", view)
+        visible += [enemy for enemy in self.awake if view.colliderect(enemy.rect)]
+        visible += [sprite for group in (self.bullets, self.waves) for sprite in group
+                    if view.colliderect(sprite.rect)]
+        visible.append(self.player)
+        renderer.blits([(sprite.image, sprite.rect.move(offset)) for sprite in visible], doreturn=False)
+        if self.projectiles is not None:
+            self.projectiles.draw(renderer, offset, alpha)
+        profiler.mark("draw")
+        draw_ui(self)
+        if profiler.overlay:
+            profiler.draw_overlay(renderer)
+        profiler.mark("ui")
+        renderer.present()
+        profiler.mark("present")
+
+
+def new_world(level_index=0, seed=None):
+    global world
+    world = World(level_index, seed)
+    return world
 
-    screen.fill(BLACK)
-    all_sprites.draw(screen)
-    draw_ui(player)
-    pygame.display.flip()
-    clock.tick(FPS)
 
-pygame.quit()
\ No newline at end of file
+# --- Игровой цикл ---
+def run_game(record=None, render_fps=RENDER_FPS):
+    # Симуляция идёт шагами SIM_STEP мс игрового времени - столько, сколько их
+    # набралось в accumulator с прошлого кадра; кадр рисуется между двумя
+    # последними шагами. Выстрелы и пауза, пришедшие между шагами, ждут следующего шага
+    recorder = InputRecorder(record, world) if record else None
+    accumulator = 0.0
+    fire_targets = []
+    paused = False
+    clock.tick()
+    try:
+        while world.running:
+            for event in pygame.event.get():
+                if event.type in QUIT_EVENTS:
+                    world.running = False
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_SPACE:
+                        fire_targets.append(world.camera.to_world(pygame.mouse.get_pos()))
+                    if event.key == pygame.K_p:
+                        world.clock.pause()
+                    if event.key == pygame.K_F3:
+                        profiler.toggle_overlay()
+                        world.all_sprites.repaint_rect(PROFILER_RECT)
+
+            if world.clock.paused:
+                gc_safe_point()
+                pause_menu()
+                # Время в меню проходит через часы на паузе и в шаг не попадает
+                accumulator += world.clock.scaled(clock.tick())
+                world.clock.resume()
+                paused = True
+                world.all_sprites.repaint_rect(SCREEN_RECT)  # меню затёрло весь экран
+
+            profiler.begin_frame()
+            keys = pygame.key.get_pressed()
+            steps = 0
+            while accumulator >= SIM_STEP and steps < MAX_CATCH_UP_STEPS and world.running:
+                if INTERPOLATE:
+                    world.remember_positions()
+                world.game_step(keys, fire_targets)
+                world.advance_time(SIM_STEP)
+                if recorder is not None:
+                    recorder.record(keys, fire_targets, SIM_STEP, paused)
+                fire_targets = []
+                paused = False
+                accumulator -= SIM_STEP
+                steps += 1
+            accumulator %= SIM_STEP  # не догнали за MAX_CATCH_UP_STEPS - отставание отбрасываем
+            world.render_frame(accumulator / SIM_STEP if INTERPOLATE else 1.0)
+            if world.gc_pending:
+                # Кадр уже выведен: сборка уходит в ожидание, а не в шаг
+                world.gc_pending = False
+                gc_safe_point()
+            elapsed = clock.tick(render_fps)
+            profiler.mark("wait")
+            profiler.end_frame()
+            allocations.end_frame()
+            accumulator += world.clock.scaled(elapsed)
+    finally:
+        if recorder is not None:
+            recorder.close(world)
+
+
+# --- Режим без окна ---
+class ScriptedKeys:
+    # Замена pygame.key.get_pressed() для заданного сценарием ввода
+    def __init__(self, pressed=()):
+        self.pressed = frozenset(pressed)
+
+    def __getitem__(self, key_code):
+        return key_code in self.pressed
+
+
+SCRIPT_KEYS = {"left": pygame.K_LEFT, "right": pygame.K_RIGHT, "up": pygame.K_UP, "down": pygame.K_DOWN}
+
+
+def load_input_script(path):
+    # JSON-список по тикам: {"keys": ["left", "up"], "fire": [[x, y]]};
+    # после конца списка игрок стоит на месте
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    script = [(ScriptedKeys(SCRIPT_KEYS[name] for name in entry.get("keys", ())),
+               [tuple(target) for target in entry.get("fire", ())])
+              for entry in entries]
+
+    def next_input(tick):
+        if tick < len(script):
+            return script[tick]
+        return ScriptedKeys(), []
+    return next_input
+
+
+def run_headless(level_index, ticks, next_input=None, dt=SIM_STEP, seed=None, record=None):
+    # Прогон уровня на ticks тиков с фиксированным шагом dt мс без отрисовки
+    # и без ожидания реального времени; next_input(tick) -> (keys, fire_targets)
+    game = new_world(level_index, seed)
+    recorder = InputRecorder(record, game) if record else None
+    idle = ScriptedKeys()
+    tick = 0
+    while tick < ticks and game.running:
+        keys, fire_targets = next_input(tick) if next_input is not None else (idle, [])
+        profiler.begin_frame()
+        game.game_step(keys, fire_targets)
+        profiler.end_frame()
+        allocations.end_frame()
+        game.advance_time(dt)
+        if recorder is not None:
+            recorder.record(keys, fire_targets, dt)
+        tick += 1
+    if recorder is not None:
+        recorder.close(game)
+    return {
+        "health": game.player.health,
+        "score": game.player.score,
+        "level": game.current_level,
+        "ticks": tick,
+        "won": game.won,
+    }
+
+
+# --- Запись и повтор ввода ---
+# Файл записи: сигнатура, seed мира и стартовый уровень, затем блоки подряд
+# идущих одинаковых тиков (клавиши, пауза, шаг времени; тик с выстрелами -
+# отдельный блок с точками выстрелов), нулевой блок и итог прогона для сверки
+RECORD_MAGIC = b"ECHOREC3"
+RECORD_HEADER = struct.Struct("<QH")  # seed мира, стартовый уровень
+RECORD_BLOCK = struct.Struct("<HBBd")  # тиков в блоке, клавиши и пауза, число выстрелов, шаг в мс
+RECORD_FIRE = struct.Struct("<dd")  # точка выстрела в координатах мира; из скрипта она бывает дробной
+RECORD_RESULT = struct.Struct("<IiiHBI")  # тиков, здоровье, очки, уровень, победа, digest()
+RECORD_KEYS = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN)
+RECORD_PAUSE = 0x80
+RECORD_FIELDS = ("ticks", "health", "score", "level", "won", "digest")
+record_keys = [ScriptedKeys(key for bit, key in enumerate(RECORD_KEYS) if mask >> bit & 1)
+               for mask in range(1 << len(RECORD_KEYS))]
+
+
+def keys_mask(keys):
+    mask = 0
+    for bit, key in enumerate(RECORD_KEYS):
+        if keys[key]:
+            mask |= 1 << bit
+    return mask
+
+
+def record_result(game, ticks):
+    player = game.player
+    return ticks, player.health, player.score, game.current_level, int(game.won), game.digest()
+
+
+class InputRecorder:
+    # Пишет ввод по тикам прямо в файл, поэтому после падения игры записанное
+    # до него можно воспроизвести (только без сверки итога)
+    def __init__(self, path, game):
+        self.file = open(path, 'wb')
+        self.file.write(RECORD_MAGIC + RECORD_HEADER.pack(game.seed, game.current_level))
+        self.block = None  # (клавиши, шаг) текущего блока без выстрелов
+        self.repeat = 0
+        self.ticks = 0
+
+    def record(self, keys, fire_targets, dt, paused=False):
+        mask = keys_mask(keys) | (RECORD_PAUSE if paused else 0)
+        self.ticks += 1
+        if not fire_targets and self.block == (mask, dt) and self.repeat < 0xFFFF:
+            self.repeat += 1
+            return
+        self._flush()
+        if fire_targets:
+            self.file.write(RECORD_BLOCK.pack(1, mask, len(fire_targets), dt))
+            for x, y in fire_targets:
+                self.file.write(RECORD_FIRE.pack(x, y))
+            self.block = None
+        else:
+            self.block = (mask, dt)
+            self.repeat = 1
+
+    def _flush(self):
+        if self.repeat:
+            mask, dt = self.block
+            self.file.write(RECORD_BLOCK.pack(self.repeat, mask, 0, dt))
+            self.repeat = 0
+
+    def close(self, game):
+        self._flush()
+        self.file.write(RECORD_BLOCK.pack(0, 0, 0, 0.0))
+        self.file.write(RECORD_RESULT.pack(*record_result(game, self.ticks)))
+        self.file.close()
+
+
+class Recording:
+    def __init__(self, seed, level, blocks, result):
+        self.seed = seed
+        self.level = level
+        self.blocks = blocks  # (тиков, клавиши и пауза, точки выстрелов, шаг)
+        self.result = result  # кортеж как у record_result или None, если запись оборвана
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(RECORD_MAGIC):
+            raise ValueError(f"{path}: это не запись ввода")
+        seed, level = RECORD_HEADER.unpack_from(data, len(RECORD_MAGIC))
+        offset = len(RECORD_MAGIC) + RECORD_HEADER.size
+        blocks = []
+        result = None
+        try:
+            while True:
+                repeat, mask, fire_count, dt = RECORD_BLOCK.unpack_from(data, offset)
+                offset += RECORD_BLOCK.size
+                if repeat == 0:
+                    result = RECORD_RESULT.unpack_from(data, offset)
+                    break
+                fire_targets = [RECORD_FIRE.unpack_from(data, offset + i * RECORD_FIRE.size)
+                                for i in range(fire_count)]
+                offset += fire_count * RECORD_FIRE.size
+                blocks.append((repeat, mask, fire_targets, dt))
+        except struct.error:  # запись оборвана - берём целые блоки
+            pass
+        return cls(seed, level, blocks, result)
+
+    def __len__(self):
+        return sum(block[0] for block in self.blocks)
+
+    def inputs(self):
+        # По тику: (клавиши, точки выстрелов, шаг в мс)
+        for repeat, mask, fire_targets, dt in self.blocks:
+            keys = record_keys[mask & ~RECORD_PAUSE]
+            for _ in range(repeat):
+                yield keys, fire_targets, dt
+
+
+def replay(path):
+    # Повтор записи без окна с максимальной скоростью; возвращает итог и
+    # совпал ли он с записанным (None, если итога в записи нет)
+    recording = Recording.load(path)
+    game = new_world(recording.level, recording.seed)
+    ticks = 0
+    for keys, fire_targets, dt in recording.inputs():
+        profiler.begin_frame()
+        game.game_step(keys, fire_targets)
+        profiler.end_frame()
+        allocations.end_frame()
+        game.advance_time(dt)
+        ticks += 1
+    result = record_result(game, ticks)
+    report = dict(zip(RECORD_FIELDS, result))
+    report["won"] = bool(report["won"])
+    report["match"] = None if recording.result is None else tuple(recording.result) == result
+    if recording.result is not None and not report["match"]:
+        report["expected"] = dict(zip(RECORD_FIELDS, recording.result))
+    return report
+
+
+def main(argv=None):
+    global HEADLESS
+    import argparse
+    parser = argparse.ArgumentParser(description=TITLE)
+    parser.add_argument("--headless", action="store_true", help="прогон уровня без окна")
+    parser.add_argument("--level", type=int, default=0, help="уровень для --headless")
+    parser.add_argument("--ticks", type=int, default=FPS * 60, help="сколько тиков считать в --headless")
+    parser.add_argument("--dt", type=float, default=SIM_STEP, help="шаг симуляции в --headless, мс")
+    parser.add_argument("--input", help="JSON-сценарий ввода по тикам для --headless")
+    parser.add_argument("--seed", type=int, help="seed случайностей уровня для --headless")
+    parser.add_argument("--speed", type=float, default=1.0, help="множитель скорости игры")
+    parser.add_argument("--renderer", choices=RENDERERS, help="бэкенд отрисовки, по умолчанию ECHO_RENDERER или surface")
+    parser.add_argument("--render-fps", type=int, default=RENDER_FPS, help="предел частоты кадров, 0 - без предела")
+    parser.add_argument("--profile", action="store_true", help="сразу показать оверлей профайлера (F3)")
+    parser.add_argument("--profile-csv", help="писать времена фаз каждого кадра в CSV")
+    parser.add_argument("--alloc-report", help="память каждого кадра в CSV, места, где она копится, - в <имя>-sites.txt")
+    parser.add_argument("--build-levels", action="store_true", help="собрать пакет уровней из levels/source.txt")
+    parser.add_argument("--record", help="записать ввод сессии в файл")
+    parser.add_argument("--replay", help="повторить запись без окна и сверить итог")
+    args = parser.parse_args(argv)
+    if not 0 < args.speed < math.inf:
+        parser.error("--speed должен быть положительным числом")  # иначе игровое время стоит
+    if args.build_levels:
+        manifest = write_level_pack(LEVEL_DIR, read_level_source(os.path.join(LEVEL_DIR, "source.txt")))
+        print(f"Уровней: {len(manifest['levels'])}, разных карт: {len(manifest['layouts'])}")
+        return
+    HEADLESS = HEADLESS or args.headless or bool(args.replay)
+    if args.profile_csv:
+        profiler.open_csv(args.profile_csv)
+    if args.profile:
+        profiler.toggle_overlay()
+    if args.alloc_report:
+        allocations.start(args.alloc_report)
+    init_display(args.renderer)
+    status = 0
+    if args.replay:
+        report = replay(args.replay)
+        print(json.dumps(report))
+        status = 1 if report["match"] is False else 0
+    elif HEADLESS:
+        next_input = load_input_script(args.input) if args.input else None
+        print(json.dumps(run_headless(args.level, args.ticks, next_input, args.dt, args.seed, args.record)))
+    else:
+        new_world(seed=args.seed).clock.scale = args.speed
+        main_menu()
+        run_game(args.record, args.render_fps)
+    profiler.close()
+    allocations.close()
+    progress_store.close()
+    pygame.quit()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()